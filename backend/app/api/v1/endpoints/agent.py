@@ -1,30 +1,178 @@
 
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, BackgroundTasks
-from typing import Optional
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, BackgroundTasks, Request
+from fastapi.responses import JSONResponse, Response
+from typing import List, Optional
+import asyncio
+import re
 from app.models.schemas import AgentRequest, AgentResponse
 from app.services.agent_planner import agent_planner
 from app.services.agent_executor import agent_executor
+from app.services.step_handlers import InputFile
 from app.services.history_service import history_service
+from app.services.admission_service import admission_service, AdmissionRejected
+from app.services.content_service import content_service
+from app.services.llm_gemini import gemini_service
+from app.core.config import settings
+from app.core.deadline import Deadline
 from app.core.logging import logger
 
 router = APIRouter()
 
+# Client-chosen run IDs for progress polling; long enough to be unguessable
+PROGRESS_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+async def _cancel_on_disconnect(request: Request, task: asyncio.Task) -> bool:
+    """Polls the client connection and cancels the agent run if the client goes away"""
+    while not task.done():
+        if await request.is_disconnected():
+            logger.warning("Client disconnected; cancelling agent run")
+            task.cancel()
+            return True
+        await asyncio.sleep(settings.DISCONNECT_POLL_INTERVAL_S)
+    return False
+
 @router.post("/run", response_model=AgentResponse)
 async def run_agent(
+    request: Request,
     text: Optional[str] = Form(None),
     file: Optional[UploadFile] = File(None),
+    files: Optional[List[UploadFile]] = File(None),
     conversation_id: Optional[str] = Form(None),
-    clarification_answer: Optional[str] = Form(None)
+    clarification_answer: Optional[str] = Form(None),
+    timeout_s: Optional[float] = Form(None),
+    fields: Optional[str] = Form(None),
+    progress_id: Optional[str] = Form(None)
 ):
-    logger.info(f"Agent run request: text={text}, file={file.filename if file else 'None'}")
+    # `file` is the single-upload form field; `files` may repeat for several uploads
+    uploads = ([file] if file else []) + (files or [])
+    logger.info(f"Agent run request: text={text}, files={[u.filename for u in uploads] or 'None'}")
+    if len(uploads) > settings.MAX_FILES_PER_REQUEST:
+        return AgentResponse(status="error", error=f"Too many files: at most {settings.MAX_FILES_PER_REQUEST} per request")
+    if progress_id and not PROGRESS_ID_PATTERN.match(progress_id):
+        return AgentResponse(status="error", error="progress_id must be 16-64 letters, digits, '-' or '_'")
+    # Partial results (e.g. transcripts of long recordings) appear at GET /content/progress-<progress_id>
+    progress_content_id = f"progress-{progress_id}" if progress_id else None
     
+    # One budget for the whole request (queue wait included), clamped to server limits
+    deadline = Deadline.from_request(timeout_s)
+    client_id = _client_id(request)
+    task = asyncio.create_task(_admitted_run(client_id, text, uploads, conversation_id, clarification_answer, deadline, progress_content_id))
+    watcher = asyncio.create_task(_cancel_on_disconnect(request, task))
     try:
-        # 1. Read file if any
-        file_bytes = None
-        file_type = None
-        if file:
-            file_bytes = await file.read()
-            file_type = file.content_type
+        response = await task
+        return _select_fields(response, fields)
+    except AdmissionRejected as e:
+        return JSONResponse(
+            status_code=429,
+            content=AgentResponse(status="error", error=f"Server busy: {e}").model_dump(),
+            headers={"Retry-After": str(e.retry_after_s)}
+        )
+    except asyncio.CancelledError:
+        if watcher.done() and not watcher.cancelled() and watcher.result():
+            # Nobody is listening any more; the response is only for the access log
+            return AgentResponse(status="error", error="Client disconnected")
+        raise
+    finally:
+        watcher.cancel()
+
+def _client_id(request: Request) -> str:
+    """Identity used for admission fairness; a client-supplied header is only trusted when configured"""
+    if settings.ADMISSION_TRUST_CLIENT_ID_HEADER and request.headers.get("x-client-id"):
+        return request.headers["x-client-id"]
+    return request.client.host if request.client else "unknown"
+
+def _select_fields(response: AgentResponse, fields: Optional[str]):
+    """Returns only the comma-separated response fields the client asked for (status is always kept)"""
+    if not fields:
+        return response
+    selected = {f.strip() for f in fields.split(",") if f.strip() in AgentResponse.model_fields}
+    return JSONResponse(content=response.model_dump(include=selected | {"status"}))
+
+def _parse_range(range_header: str, size: int) -> Optional[tuple[int, int]]:
+    """Parses a single `bytes=start-end` range into inclusive offsets; None if unsatisfiable"""
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start_s, _, end_s = spec.strip().partition("-")
+    try:
+        if not start_s:
+            # Suffix range: last N bytes
+            length = int(end_s)
+            if length <= 0:
+                return None
+            return max(0, size - length), size - 1
+        start = int(start_s)
+        end = int(end_s) if end_s else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+@router.get("/content/{content_id}")
+async def get_content(content_id: str, request: Request):
+    """Serves full extracted text by reference; supports single byte-range requests"""
+    data = content_service.get_bytes(content_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Content not found or expired")
+
+    media_type = "text/plain; charset=utf-8"
+    range_header = request.headers.get("range")
+    if not range_header:
+        return Response(content=data, media_type=media_type, headers={"Accept-Ranges": "bytes"})
+
+    byte_range = _parse_range(range_header, len(data))
+    if byte_range is None:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{len(data)}"})
+    start, end = byte_range
+    return Response(
+        content=data[start:end + 1],
+        status_code=206,
+        media_type=media_type,
+        headers={"Accept-Ranges": "bytes", "Content-Range": f"bytes {start}-{end}/{len(data)}"}
+    )
+
+@router.get("/admission")
+async def admission_stats():
+    """Queue depth, wait-time and throughput metrics of the admission layer"""
+    return admission_service.stats()
+
+@router.get("/transport")
+async def transport_stats():
+    """Gemini connection reuse and pool queue-time metrics"""
+    return gemini_service.stats()
+
+async def _admitted_run(
+    client_id: str,
+    text: Optional[str],
+    uploads: List[UploadFile],
+    conversation_id: Optional[str],
+    clarification_answer: Optional[str],
+    deadline: Deadline,
+    progress_id: Optional[str] = None
+) -> AgentResponse:
+    # Uploads go to the heavy lane so large files can't starve quick text turns
+    async with admission_service.admit(
+        client_id,
+        conversation_id=conversation_id,
+        heavy=bool(uploads),
+        max_wait_s=deadline.remaining()
+    ):
+        return await _run_agent(text, uploads, conversation_id, clarification_answer, deadline, progress_id)
+
+async def _run_agent(
+    text: Optional[str],
+    uploads: List[UploadFile],
+    conversation_id: Optional[str],
+    clarification_answer: Optional[str],
+    deadline: Deadline,
+    progress_id: Optional[str] = None
+) -> AgentResponse:
+    try:
+        # 1. Read files if any
+        contents = await asyncio.gather(*(u.read() for u in uploads))
+        input_files = [InputFile(u.filename, u.content_type, data) for u, data in zip(uploads, contents)]
+        file_types = [f.content_type for f in input_files]
             
         # 1.5. Update History (User)
         if conversation_id and text:
@@ -39,23 +187,20 @@ async def run_agent(
         
         status, clarification_question, plan = await agent_planner.create_plan(
             user_text=text or "",
-            file_type=file_type,
+            file_type=file_types[0] if file_types else None,
+            file_types=file_types,
             has_youtube=has_youtube,
             conversation_history=history,
-            clarification_answer=clarification_answer
+            clarification_answer=clarification_answer,
+            deadline=deadline
         )
         
         if status == "needs_clarification":
             # Extract content even during clarification for context
             extracted_text = ""
-            if file_bytes and file_type:
+            if input_files:
                 try:
-                    if 'pdf' in file_type:
-                        from app.services.pdf_service import pdf_service
-                        extracted_text, _ = pdf_service.extract_text(file_bytes)
-                    elif 'image' in file_type:
-                        from app.services.ocr_service import ocr_service
-                        extracted_text, _ = await ocr_service.extract_text(file_bytes)
+                    extracted_text = await agent_executor.extract_files(input_files, deadline=deadline)
                     
                     # Store extracted content in history for future reference
                     if conversation_id and extracted_text:
@@ -67,16 +212,17 @@ async def run_agent(
                 status="needs_clarification",
                 clarification_question=clarification_question,
                 plan=plan,
-                extracted_text=extracted_text
+                extracted_content=content_service.put(extracted_text) if extracted_text else None
             )
             
         # 4. Execute
         response = await agent_executor.execute_plan(
             plan=plan,
             text=text or "",
-            file_bytes=file_bytes,
-            file_name=file.filename if file else None,
-            conversation_history=history
+            files=input_files,
+            conversation_history=history,
+            deadline=deadline,
+            progress_id=progress_id
         )
         
         # 5. Update History (Agent)
@@ -85,7 +231,8 @@ async def run_agent(
              agent_content = ""
              if response.final_output:
                  agent_content = str(response.final_output.get('message', ''))
-             history_service.add_message(conversation_id, "agent", agent_content, response.extracted_text)
+             extracted_text = content_service.get_text(response.extracted_content.content_id) if response.extracted_content else None
+             history_service.add_message(conversation_id, "agent", agent_content, extracted_text)
 
         return response
         
@@ -11,10 +11,60 @@ class Settings(BaseSettings):
     GEMINI_API_KEY: str
     YOUTUBE_API_KEY: Optional[str] = None
     
+    # Gemini REST transport
+    GEMINI_MODEL: str = "gemini-2.5-flash"
+    GEMINI_API_BASE_URL: str = "https://generativelanguage.googleapis.com"
+    GEMINI_POOL_SIZE: int = 20
+    GEMINI_KEEPALIVE_S: float = 120.0
+    GEMINI_CONNECT_TIMEOUT_S: float = 10.0
+    GEMINI_BLOCKING_WORKERS: int = 4
+    GEMINI_UPLOAD_POLL_S: float = 1.0
+    GEMINI_WARMUP: bool = True
+    GEMINI_WARMUP_CONNECTIONS: int = 2
+    
     # Feature Flags
     ENABLE_COST_ESTIMATOR: bool = True
     LOG_LEVEL: str = "INFO"
-    
+
+    # Request deadlines (seconds). Clients may request a budget within [MIN, MAX].
+    REQUEST_TIMEOUT_DEFAULT_S: float = 90.0
+    REQUEST_TIMEOUT_MIN_S: float = 5.0
+    REQUEST_TIMEOUT_MAX_S: float = 300.0
+    PLANNER_TIMEOUT_S: float = 10.0
+    LLM_CALL_TIMEOUT_S: float = 60.0
+    DISCONNECT_POLL_INTERVAL_S: float = 0.5
+
+    # Segmented audio transcription (WAV is split locally, other formats are decoded with ffmpeg first)
+    AUDIO_SEGMENT_S: float = 60.0
+    AUDIO_SEGMENT_OVERLAP_S: float = 5.0
+    AUDIO_TRANSCRIBE_CONCURRENCY: int = 4
+    AUDIO_DECODE_SAMPLE_RATE: int = 16000 # Non-WAV uploads are decoded to mono PCM at this rate
+    # Base64-encoded size up to which a clip is sent inline (request limit ~20MB incl. prompt)
+    AUDIO_INLINE_MAX_BYTES: int = 18 * 1024 * 1024
+
+    # Admission control for /agent/run
+    ADMISSION_MAX_CONCURRENT: int = 8
+    ADMISSION_TEXT_WEIGHT: int = 3
+    ADMISSION_FILE_WEIGHT: int = 1
+    ADMISSION_MAX_RUNS_PER_CLIENT: int = 2
+    ADMISSION_MAX_RUNS_PER_CONVERSATION: int = 1
+    ADMISSION_MAX_QUEUED_PER_CLIENT: int = 10
+    ADMISSION_MAX_QUEUE_WAIT_S: float = 20.0
+    # Key fairness on X-Client-Id instead of the peer address; only behind a proxy that sets it
+    ADMISSION_TRUST_CLIENT_ID_HEADER: bool = False
+
+    # Extracted content is stored server-side and returned by reference
+    CONTENT_STORE_MAX_BYTES: int = 256 * 1024 * 1024
+    CONTENT_PREVIEW_CHARS: int = 500
+    CONTENT_SOURCE_CACHE_SIZE: int = 10000
+
+    # Multi-file uploads: per-type extraction concurrency shared across requests
+    MAX_FILES_PER_REQUEST: int = 10
+    EXTRACT_POOL_PDF: int = 4
+    EXTRACT_POOL_IMAGE: int = 4
+    EXTRACT_POOL_AUDIO: int = 2
+    GZIP_MIN_SIZE: int = 1024
+
     class Config:
         env_file = ".env"
         case_sensitive = True
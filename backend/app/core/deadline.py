@@ -0,0 +1,60 @@
+
+import asyncio
+import time
+from typing import Any, Awaitable, Optional
+from app.core.config import settings
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """Raised when the request-wide budget runs out."""
+
+class Deadline:
+    """
+    Request-wide time budget shared by the planner, the executor and every service call.
+    Each call gets the remaining budget, optionally capped by its own per-call timeout.
+    """
+    def __init__(self, budget_s: float):
+        self.budget_s = budget_s
+        self._expires_at = time.monotonic() + budget_s
+
+    @classmethod
+    def from_request(cls, requested_s: Optional[float] = None) -> "Deadline":
+        """Build a deadline from the client's requested budget, clamped to server limits"""
+        budget = requested_s if requested_s and requested_s > 0 else settings.REQUEST_TIMEOUT_DEFAULT_S
+        budget = max(settings.REQUEST_TIMEOUT_MIN_S, min(budget, settings.REQUEST_TIMEOUT_MAX_S))
+        return cls(budget)
+
+    def remaining(self) -> float:
+        return max(0.0, self._expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: Optional[float] = None) -> float:
+        """Remaining budget, capped by the per-call timeout. Raises if nothing is left."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Request deadline of {self.budget_s:.0f}s exceeded")
+        return min(remaining, cap) if cap else remaining
+
+    async def wait_for(self, aw: Awaitable[Any], cap: Optional[float] = None) -> Any:
+        """
+        Awaits `aw` within the remaining budget. The awaitable is cancelled on expiry,
+        which aborts in-flight HTTP calls made through it.
+        """
+        try:
+            timeout = self.timeout(cap)
+        except DeadlineExceeded:
+            if asyncio.iscoroutine(aw):
+                aw.close()
+            raise
+        try:
+            return await asyncio.wait_for(aw, timeout)
+        except asyncio.TimeoutError:
+            if self.expired:
+                raise DeadlineExceeded(f"Request deadline of {self.budget_s:.0f}s exceeded")
+            raise
+
+def ensure_deadline(deadline: Optional[Deadline]) -> Deadline:
+    """Services accept an optional deadline; fall back to the server default when called directly"""
+    return deadline or Deadline.from_request()
@@ -1,11 +1,25 @@
 
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from app.api.v1.routes import api_router
 from app.core.config import settings
 from app.core.logging import logger
+from app.services.llm_gemini import gemini_service
 
-app = FastAPI(title=settings.PROJECT_NAME)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open Gemini connections before the first user request pays for TLS setup
+    try:
+        await asyncio.wait_for(gemini_service.warm_up(), timeout=settings.GEMINI_CONNECT_TIMEOUT_S)
+    except Exception as e:
+        logger.warning(f"Gemini warm-up skipped: {e}")
+    yield
+    await gemini_service.aclose()
+
+app = FastAPI(title=settings.PROJECT_NAME, lifespan=lifespan)
 
 # CORS
 app.add_middleware(
@@ -16,6 +30,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large JSON/text responses; small ones aren't worth the CPU
+app.add_middleware(GZipMiddleware, minimum_size=settings.GZIP_MIN_SIZE, compresslevel=6)
+
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
 @app.get("/health")
@@ -5,7 +5,7 @@ from typing import Optional, List, Dict, Any, Literal
 class PlanStep(BaseModel):
     name: str
     description: str
-    status: Literal["pending", "running", "completed", "failed"] = "pending"
+    status: Literal["pending", "running", "completed", "failed", "cancelled", "skipped"] = "pending"
 
 class LogEntry(BaseModel):
     step_name: str
@@ -15,10 +15,22 @@ class LogEntry(BaseModel):
     duration_ms: float
     cost_estimate: Optional[float] = None
 
+class TranscriptSegment(BaseModel):
+    index: int
+    start_s: float
+    end_s: float
+    text: str
+
+class ExtractedContentRef(BaseModel):
+    content_id: str
+    length: int # characters
+    byte_length: int # UTF-8 bytes, the unit for range requests
+    preview: str
+
 class AgentResponse(BaseModel):
-    status: Literal["success", "error", "needs_clarification"]
+    status: Literal["success", "error", "needs_clarification", "partial"]
     clarification_question: Optional[str] = None
-    extracted_text: Optional[str] = None
+    extracted_content: Optional[ExtractedContentRef] = None
     final_output: Optional[Dict[str, Any]] = None
     task_type: Optional[str] = None
     plan: List[PlanStep] = []
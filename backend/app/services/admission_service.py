@@ -0,0 +1,228 @@
+
+from app.core.config import settings
+from app.core.logging import logger
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+import asyncio
+import math
+import time
+
+class AdmissionRejected(Exception):
+    """Raised when a run is shed instead of queued; carries the Retry-After hint"""
+    def __init__(self, reason: str, retry_after_s: int):
+        super().__init__(reason)
+        self.retry_after_s = retry_after_s
+
+class _Waiter:
+    __slots__ = ("future", "client_id", "conversation_id", "lane", "enqueued_at")
+
+    def __init__(self, future: asyncio.Future, client_id: str, conversation_id: Optional[str], lane: str):
+        self.future = future
+        self.client_id = client_id
+        self.conversation_id = conversation_id
+        self.lane = lane
+        self.enqueued_at = time.monotonic()
+
+class AdmissionService:
+    """
+    Bounds how many agent runs execute at once.
+    Waiting runs sit in weighted lanes ("text" for cheap requests, "file" for uploads); within a
+    lane the client served least recently goes first (immediate admissions count as served),
+    and a conversation never runs twice concurrently.
+    Runs whose expected queue wait is too long are rejected with a Retry-After hint.
+    """
+    LANES = ("text", "file")
+    MAX_TRACKED_CLIENTS = 10000
+
+    def __init__(self):
+        self.max_concurrent = settings.ADMISSION_MAX_CONCURRENT
+        self.weights = {"text": settings.ADMISSION_TEXT_WEIGHT, "file": settings.ADMISSION_FILE_WEIGHT}
+        self._running = 0
+        self._running_by_client: Counter = Counter()
+        self._running_by_conversation: Counter = Counter()
+        # lane -> client_id -> FIFO of that client's waiters, in order of first arrival
+        self._queues: Dict[str, Dict[str, Deque[_Waiter]]] = {lane: {} for lane in self.LANES}
+        # lane -> client_id -> sequence number of the client's last admission (LRU-bounded)
+        self._last_served: Dict[str, "OrderedDict[str, int]"] = {lane: OrderedDict() for lane in self.LANES}
+        self._serve_seq = 0
+        self._credits = {lane: 0 for lane in self.LANES}
+        self._avg_run_s = 5.0 # EWMA of run duration, seeded with a typical single-step run
+        self._waits_ms = {lane: deque(maxlen=200) for lane in self.LANES}
+        self._admitted: Counter = Counter()
+        self._rejected: Counter = Counter()
+
+    @asynccontextmanager
+    async def admit(
+        self,
+        client_id: str,
+        conversation_id: Optional[str] = None,
+        heavy: bool = False,
+        max_wait_s: Optional[float] = None
+    ):
+        """Holds an execution slot for the duration of the block"""
+        lane = "file" if heavy else "text"
+        await self._acquire(client_id, conversation_id, lane, max_wait_s)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(client_id, conversation_id, time.monotonic() - started)
+
+    async def _acquire(self, client_id: str, conversation_id: Optional[str], lane: str, max_wait_s: Optional[float]):
+        if self._queued_total() == 0 and self._can_run(client_id, conversation_id):
+            self._start(client_id, conversation_id, lane, 0.0)
+            return
+
+        if self._queued_for_client(client_id) >= settings.ADMISSION_MAX_QUEUED_PER_CLIENT:
+            self._reject(lane, f"Too many queued requests for client {client_id}")
+
+        max_wait_s = min(max_wait_s, settings.ADMISSION_MAX_QUEUE_WAIT_S) if max_wait_s else settings.ADMISSION_MAX_QUEUE_WAIT_S
+        estimate = self._estimated_wait_s()
+        if estimate > max_wait_s:
+            self._reject(lane, f"Estimated queue wait {estimate:.1f}s exceeds {max_wait_s:.1f}s", estimate)
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), client_id, conversation_id, lane)
+        self._queues[lane].setdefault(client_id, deque()).append(waiter)
+        # Queued runs may all be blocked on their conversation; a free slot can go to us right away
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), max_wait_s)
+        except asyncio.TimeoutError:
+            if waiter.future.done():
+                return
+            waiter.future.cancel()
+            self._remove(waiter)
+            self._reject(lane, f"Queued longer than {max_wait_s:.1f}s")
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted in the same tick the client went away: hand the slot back
+                self._release(client_id, conversation_id, None)
+            else:
+                waiter.future.cancel()
+                self._remove(waiter)
+            raise
+
+    def _start(self, client_id: str, conversation_id: Optional[str], lane: str, waited_s: float):
+        self._running += 1
+        self._running_by_client[client_id] += 1
+        if conversation_id:
+            self._running_by_conversation[conversation_id] += 1
+        self._admitted[lane] += 1
+        self._waits_ms[lane].append(waited_s * 1000)
+        self._serve_seq += 1
+        served = self._last_served[lane]
+        served[client_id] = self._serve_seq
+        served.move_to_end(client_id)
+        if len(served) > self.MAX_TRACKED_CLIENTS:
+            served.popitem(last=False)
+
+    def _release(self, client_id: str, conversation_id: Optional[str], run_s: Optional[float]):
+        self._running -= 1
+        self._running_by_client[client_id] -= 1
+        if self._running_by_client[client_id] <= 0:
+            del self._running_by_client[client_id]
+        if conversation_id:
+            self._running_by_conversation[conversation_id] -= 1
+            if self._running_by_conversation[conversation_id] <= 0:
+                del self._running_by_conversation[conversation_id]
+        if run_s is not None:
+            self._avg_run_s = 0.8 * self._avg_run_s + 0.2 * run_s
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._running < self.max_concurrent:
+            waiter = self._next_waiter()
+            if not waiter:
+                return
+            self._start(waiter.client_id, waiter.conversation_id, waiter.lane, time.monotonic() - waiter.enqueued_at)
+            waiter.future.set_result(None)
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        # Smooth weighted round-robin across lanes that have something runnable
+        candidates = {}
+        for lane in self.LANES:
+            waiter = self._peek_lane(lane)
+            if waiter:
+                candidates[lane] = waiter
+        if not candidates:
+            return None
+        total = sum(self.weights[lane] for lane in candidates)
+        for lane in candidates:
+            self._credits[lane] += self.weights[lane]
+        lane = max(candidates, key=lambda name: self._credits[name])
+        self._credits[lane] -= total
+
+        waiter = candidates[lane]
+        self._remove(waiter)
+        return waiter
+
+    def _peek_lane(self, lane: str) -> Optional[_Waiter]:
+        # Round-robin: the client admitted longest ago (or never) goes first; ties keep arrival order
+        served = self._last_served[lane]
+        best = None
+        for client_id, waiters in self._queues[lane].items():
+            runnable = next((w for w in waiters if self._can_run(w.client_id, w.conversation_id)), None)
+            if runnable and (best is None or served.get(client_id, 0) < served.get(best.client_id, 0)):
+                best = runnable
+        return best
+
+    def _can_run(self, client_id: str, conversation_id: Optional[str]) -> bool:
+        if self._running >= self.max_concurrent:
+            return False
+        if self._running_by_client[client_id] >= settings.ADMISSION_MAX_RUNS_PER_CLIENT:
+            return False
+        if conversation_id and self._running_by_conversation[conversation_id] >= settings.ADMISSION_MAX_RUNS_PER_CONVERSATION:
+            return False
+        return True
+
+    def _remove(self, waiter: _Waiter):
+        queue = self._queues[waiter.lane]
+        waiters = queue.get(waiter.client_id)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(waiter)
+        except ValueError:
+            pass
+        if not waiters:
+            del queue[waiter.client_id]
+
+    def _reject(self, lane: str, reason: str, estimate_s: Optional[float] = None):
+        self._rejected[lane] += 1
+        retry_after = max(1, math.ceil(estimate_s if estimate_s is not None else self._avg_run_s))
+        logger.warning(f"Admission rejected ({lane}): {reason}; retry after {retry_after}s")
+        raise AdmissionRejected(reason, retry_after)
+
+    def _estimated_wait_s(self) -> float:
+        if self._running < self.max_concurrent:
+            return 0.0
+        # Everyone ahead plus us, drained max_concurrent at a time
+        return math.ceil((self._queued_total() + 1) / self.max_concurrent) * self._avg_run_s
+
+    def _queued_total(self) -> int:
+        return sum(len(w) for lane in self.LANES for w in self._queues[lane].values())
+
+    def _queued_for_client(self, client_id: str) -> int:
+        return sum(len(self._queues[lane].get(client_id, ())) for lane in self.LANES)
+
+    def stats(self) -> dict:
+        lanes = {}
+        for lane in self.LANES:
+            waits = sorted(self._waits_ms[lane])
+            lanes[lane] = {
+                "queue_depth": sum(len(w) for w in self._queues[lane].values()),
+                "weight": self.weights[lane],
+                "admitted": self._admitted[lane],
+                "rejected": self._rejected[lane],
+                "avg_wait_ms": round(sum(waits) / len(waits), 1) if waits else 0.0,
+                "p95_wait_ms": round(waits[int(0.95 * (len(waits) - 1))], 1) if waits else 0.0
+            }
+        return {
+            "running": self._running,
+            "max_concurrent": self.max_concurrent,
+            "avg_run_s": round(self._avg_run_s, 2),
+            "lanes": lanes
+        }
+
+admission_service = AdmissionService()
@@ -1,205 +1,141 @@
 
 from app.models.schemas import PlanStep, LogEntry, AgentResponse
-from app.services.llm_gemini import gemini_service
-from app.services.ocr_service import ocr_service
-from app.services.pdf_service import pdf_service
-from app.services.youtube_service import youtube_service
-from app.services.audio_service import audio_service
+from app.services.step_handlers import ExecutionContext, InputFile, step_registry
+from app.services.plan_optimizer import plan_optimizer
+from app.services.content_service import content_service
 from app.core.logging import logger
-import json
+from app.core.deadline import Deadline, DeadlineExceeded, ensure_deadline
+from typing import List, Optional, Tuple
+import asyncio
 import time
 
 class AgentExecutor:
     async def execute_plan(
-        self, 
-        plan: list[PlanStep], 
-        text: str, 
-        file_bytes: bytes = None, 
+        self,
+        plan: list[PlanStep],
+        text: str,
+        file_bytes: bytes = None,
         file_name: str = None,
-        conversation_history: list = None
+        conversation_history: list = None,
+        deadline: Optional[Deadline] = None,
+        file_type: Optional[str] = None,
+        files: Optional[List[InputFile]] = None,
+        progress_id: Optional[str] = None
     ) -> AgentResponse:
-        
-        logs = []
-        extracted_text = ""
-        final_output = {}
-        task_type = "general"
-        
-        # Context that flows between steps
-        execution_context = {
-            "text": text, # Raw user text
-            "extracted_text": "", # From OCR/PDF/Youtube
-            "transcripts": "" 
-        }
-
-        start_total = time.time()
-
-        for step in plan:
-            ts = time.time()
-            # Set meaningful input summary based on step type
-            input_summary = "Processing..."
-            if step.name == "extract_text_from_image":
-                input_summary = f"Extracting text from image: {file_name or 'uploaded image'}"
-            elif step.name == "extract_text_from_pdf":
-                input_summary = f"Extracting text from PDF: {file_name or 'uploaded PDF'}"
-            elif step.name == "transcribe_audio":
-                input_summary = f"Transcribing audio file: {file_name or 'uploaded audio'}"
-            elif step.name == "conversational_answer":
-                input_summary = f"Analyzing query: {text[:50]}..."
-            
-            log = LogEntry(
-                step_name=step.name,
-                input_summary=input_summary, 
-                output_summary="", 
-                status="running", 
-                duration_ms=0
-            )
-            
-            try:
-                # Dispatcher
-                if step.name == "extract_text_from_image":
-                    if file_bytes:
-                        txt, conf = await ocr_service.extract_text(file_bytes)
-                        execution_context["extracted_text"] += f"\n{txt}"
-                        log.output_summary = f"Successfully extracted {len(txt)} characters with {conf:.1%} confidence"
-                        extracted_text = txt
-                    else:
-                        log.status = "failed"
-                        log.output_summary = "No image file provided for text extraction"
-
-                elif step.name == "extract_text_from_pdf":
-                    if file_bytes:
-                        txt, conf = pdf_service.extract_text(file_bytes)
-                        execution_context["extracted_text"] += f"\n{txt}"
-                        log.output_summary = f"Successfully extracted {len(txt)} characters from PDF"
-                        extracted_text = txt
-                    else:
-                        log.status = "failed"
-                        log.output_summary = "No PDF file provided for text extraction"
-
-                elif step.name == "fetch_youtube_transcript":
-                    url = text # Simplification: assume URL in text
-                    txt, success = youtube_service.get_transcript(url)
-                    if success:
-                        execution_context["extracted_text"] += f"\n{txt}"
-                        log.output_summary = "Transcript fetched"
-                        extracted_text = txt
-                    else:
-                        log.status = "failed"
-                        log.output_summary = txt
-
-                elif step.name == "transcribe_audio":
-                    if file_bytes:
-                        # Logic to call audio service
-                        resp = await audio_service.process_audio(file_bytes, file_name or "audio.mp3")
-                        try:
-                            # If audio service returns raw JSON string from LLM
-                            audio_data = json.loads(resp)
-                            transcript = audio_data.get("transcript", "")
-                            execution_context["extracted_text"] = transcript
-                            extracted_text = transcript
-                            final_output.update(audio_data)
-                            task_type = "audio_summary"
-                            log.output_summary = f"Successfully transcribed audio - {len(transcript)} characters extracted"
-                        except:
-                            execution_context["extracted_text"] = resp
-                            log.output_summary = f"Audio transcribed - {len(resp)} characters extracted"
-                    else:
-                        log.status = "failed"
-                        log.output_summary = "No audio file provided for transcription"
-
-                elif step.name == "summarize":
-                    content = execution_context["extracted_text"] or execution_context["text"]
-                    prompt = f"Summarize this:\n{content}\nFormat as JSON: {{'one_line_summary': '', 'bullet_points': [], 'five_sentence_summary': ''}}"
-                    res = await gemini_service.generate_text(prompt)
-                    try:
-                        summ = json.loads(res.replace("```json", "").replace("```", "").strip())
-                        final_output.update(summ)
-                        task_type = "summarization"
-                    except:
-                        log.status = "failed"
-                        log.output_summary = "JSON parse error"
-
-                elif step.name == "sentiment_analysis":
-                    content = execution_context["extracted_text"] or execution_context["text"]
-                    prompt = f"Analyze sentiment:\n{content}\nFormat as JSON: {{'label': '', 'confidence': 0.0, 'justification': ''}}"
-                    res = await gemini_service.generate_text(prompt)
-                    try:
-                        sent = json.loads(res.replace("```json", "").replace("```", "").strip())
-                        final_output.update(sent)
-                        task_type = "sentiment"
-                    except:
-                        log.status = "failed"
-
-                elif step.name == "code_explanation":
-                    content = execution_context["extracted_text"] or execution_context["text"]
-                    prompt = f"Explain code:\n{content}\nFormat as JSON: {{'what_it_does': '', 'bugs_or_issues': [], 'time_complexity': ''}}"
-                    res = await gemini_service.generate_text(prompt)
-                    try:
-                         expl = json.loads(res.replace("```json", "").replace("```", "").strip())
-                         final_output.update(expl)
-                         task_type = "code_explanation"
-                    except:
-                        log.status = "failed"
+        deadline = ensure_deadline(deadline)
+        timed_out = False
 
-                elif step.name == "conversational_answer":
-                     # Fast path for simple greetings
-                     simple_greetings = {
-                         'hi': 'Hello! How can I help you today?',
-                         'hii': 'Hi there! What can I do for you?',
-                         'hello': 'Hello! I\'m here to help with any questions you have.',
-                         'hey': 'Hey! What would you like to know?'
-                     }
-                     
-                     if text.lower().strip() in simple_greetings:
-                         ans = simple_greetings[text.lower().strip()]
-                         final_output["message"] = ans
-                         task_type = "conversation"
-                         log.output_summary = "Fast greeting response"
-                     else:
-                         content = execution_context["extracted_text"] or ""
-                         
-                         # Build context with history including extracted content
-                         history_context = ""
-                         if conversation_history:
-                             history_context = "\n\nPrevious Conversation:\n"
-                             for msg in conversation_history[-6:]:  # Last 3 exchanges (6 messages)
-                                 role = msg.get('role', '').upper()
-                                 msg_content = msg.get('content', '')
-                                 extracted = msg.get('extracted_content', '')
-                                 history_context += f"{role}: {msg_content}\n"
-                                 if extracted:
-                                     history_context += f"EXTRACTED CONTENT: {extracted[:500]}...\n"
-                         
-                         prompt = f"""You are a helpful AI assistant. Use the context below to answer the user's question.
-
-Context from uploaded content:
-{content}
-{history_context}
-
-Current User Question: {text}
+        logs = []
 
-Answer the question naturally and conversationally. If the question refers to previous context (like "he", "it", "this"), use the conversation history to understand what they're referring to."""
-                         
-                         ans = await gemini_service.generate_text(prompt)
-                         final_output["message"] = ans
-                         task_type = "conversation"
+        # Context that flows between steps
+        ctx = ExecutionContext(
+            text=text,
+            files=files,
+            file_bytes=file_bytes,
+            file_name=file_name,
+            file_type=file_type,
+            conversation_history=conversation_history,
+            deadline=deadline,
+            progress_id=progress_id
+        )
 
-                log.duration_ms = (time.time() - ts) * 1000
-                log.status = "completed" if log.status == "running" else log.status
+        ts = time.time()
+        plan, decisions = plan_optimizer.optimize(plan, ctx)
+        if decisions:
+            logs.append(LogEntry(
+                step_name="optimize_plan",
+                input_summary=f"{len(plan)} planned steps",
+                output_summary="; ".join(decisions),
+                status="completed",
+                duration_ms=(time.time() - ts) * 1000
+            ))
+
+        runnable = [step for step in plan if step.status != "skipped"]
+        i = 0
+        while i < len(runnable):
+            # Out of budget: leave this and the remaining steps unfinished
+            if deadline.expired:
+                timed_out = True
+                break
+
+            # Independent steps in a row (e.g. extraction of different file types) run together
+            batch = [runnable[i]]
+            if step_registry.get(batch[0].name).concurrent:
+                while i + len(batch) < len(runnable) and step_registry.get(runnable[i + len(batch)].name).concurrent:
+                    batch.append(runnable[i + len(batch)])
+            i += len(batch)
+
+            results = await asyncio.gather(*(self._run_step(step, ctx) for step in batch))
+            for log, cancelled in results:
                 logs.append(log)
-            except Exception as e:
-                logger.error(f"Step {step.name} failed: {e}")
-                log.status = "failed"
-                log.output_summary = str(e)
-                logs.append(log)
-        
+                timed_out = timed_out or cancelled
+            # Steps that hit the deadline but kept what they finished (e.g. a partial transcript)
+            timed_out = timed_out or ctx.incomplete
+            if timed_out:
+                break
+
+        if timed_out:
+            # Return what finished; mark everything else so the UI can show it as unfinished
+            for step in plan:
+                if step.status in ("pending", "running"):
+                    step.status = "cancelled"
+            logger.warning(f"Plan stopped after {deadline.budget_s:.0f}s deadline with partial results")
+
+        extracted_text = ctx.extracted_for_response()
         return AgentResponse(
-            status="success",
-            extracted_text=extracted_text,
-            final_output=final_output,
-            task_type=task_type,
+            status="partial" if timed_out else "success",
+            error="Request deadline exceeded before all steps finished" if timed_out else None,
+            extracted_content=content_service.put(extracted_text) if extracted_text else None,
+            final_output=ctx.final_output,
+            task_type=ctx.task_type,
             plan=plan,
             logs=logs
         )
 
+    async def _run_step(self, step: PlanStep, ctx: ExecutionContext) -> Tuple[LogEntry, bool]:
+        """Runs one step. Returns: (log, cancelled_by_deadline)"""
+        handler = step_registry.get(step.name)
+        ts = time.time()
+        step.status = "running"
+        log = LogEntry(
+            step_name=step.name,
+            input_summary=handler.describe(ctx),
+            output_summary="",
+            status="running",
+            duration_ms=0
+        )
+
+        try:
+            await handler.run(ctx, log)
+
+            log.duration_ms = (time.time() - ts) * 1000
+            log.status = "completed" if log.status == "running" else log.status
+            step.status = "completed" if log.status == "completed" else "failed"
+            return log, False
+        except DeadlineExceeded as e:
+            logger.warning(f"Step {step.name} cancelled: {e}")
+            log.duration_ms = (time.time() - ts) * 1000
+            log.status = "cancelled"
+            log.output_summary = "Cancelled: request deadline exceeded"
+            return log, True
+        except Exception as e:
+            logger.error(f"Step {step.name} failed: {e}")
+            log.status = "failed"
+            log.output_summary = str(e)
+            step.status = "failed"
+            return log, False
+
+    async def extract_files(self, files: List[InputFile], deadline: Optional[Deadline] = None) -> str:
+        """Extracts text from uploaded PDFs and images concurrently, outside of a plan"""
+        ctx = ExecutionContext(text="", files=files, deadline=ensure_deadline(deadline))
+        steps = [
+            PlanStep(name=name, description="Extract file content")
+            for name in ("extract_text_from_pdf", "extract_text_from_image")
+            if ctx.files_of(step_registry.get(name).kind)
+        ]
+        for log, _ in await asyncio.gather(*(self._run_step(step, ctx) for step in steps)):
+            if log.status != "completed":
+                logger.error(f"Failed to extract content: {log.output_summary}")
+        return ctx.extracted_for_response()
+
 agent_executor = AgentExecutor()
@@ -3,6 +3,9 @@ import json
 from app.services.llm_gemini import gemini_service
 from app.models.schemas import PlanStep
 from app.core.logging import logger
+from app.core.config import settings
+from app.core.deadline import Deadline
+from app.services.step_handlers import file_kind
 from typing import List, Tuple, Optional
 
 class AgentPlanner:
@@ -26,6 +29,28 @@ class AgentPlanner:
         
         return None
     
+    def _check_multi_file_clarification(self, text: str, file_types: List[str]) -> Optional[str]:
+        """Clarification for several uploads with no instruction"""
+        if not text.strip():
+            return f"I see you've uploaded {len(file_types)} files. What would you like me to do with them? (e.g., compare, summarize, extract text)"
+        return None
+
+    def _get_multi_file_fast_plan(self, text: str, file_types: List[str]) -> Optional[List[PlanStep]]:
+        """One extraction step per file type (each covers all files of that type), then one answer over all of them"""
+        text_lower = text.lower().strip()
+        if not any(word in text_lower for word in ['rate', 'evaluate', 'analyze', 'compare']):
+            return None
+        kinds = {file_kind(t, None) for t in file_types}
+        if not kinds <= {"pdf", "image"}:
+            return None
+        plan = []
+        if "pdf" in kinds:
+            plan.append(PlanStep(name="extract_text_from_pdf", description="Extract text from all PDFs"))
+        if "image" in kinds:
+            plan.append(PlanStep(name="extract_text_from_image", description="Extract text from all images"))
+        plan.append(PlanStep(name="conversational_answer", description="Analyze all files together"))
+        return plan
+
     def _get_fast_plan(self, text: str, file_type: str = None) -> Optional[List[PlanStep]]:
         """Return fast plan for common patterns without LLM call"""
         text_lower = text.lower().strip()
@@ -60,7 +85,9 @@ class AgentPlanner:
         file_type: Optional[str] = None, 
         has_youtube: bool = False,
         conversation_history: List[str] = [],
-        clarification_answer: Optional[str] = None
+        clarification_answer: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        file_types: Optional[List[str]] = None
     ) -> Tuple[str, Optional[str], List[PlanStep]]:
         """
         Analyzes intent and creates a plan.
@@ -68,19 +95,30 @@ class AgentPlanner:
         status: "success" or "needs_clarification"
         """
         
+        file_types = file_types or ([file_type] if file_type else [])
+        multi_file = len(file_types) > 1
+
         # Check if clarification is needed first
-        clarification = self._check_clarification_needed(user_text, file_type)
+        if multi_file:
+            clarification = self._check_multi_file_clarification(user_text, file_types)
+        else:
+            clarification = self._check_clarification_needed(user_text, file_type)
         if clarification:
             return "needs_clarification", clarification, []
         
         # Fast path for common patterns
-        fast_plan = self._get_fast_plan(user_text, file_type)
+        if multi_file:
+            fast_plan = self._get_multi_file_fast_plan(user_text, file_types)
+        else:
+            fast_plan = self._get_fast_plan(user_text, file_type)
         if fast_plan:
             return "success", None, fast_plan
         
         # Construct context
         context_str = f"User Input: {user_text}\n"
-        if file_type:
+        if multi_file:
+            context_str += f"Attached Files: {len(file_types)} ({', '.join(t or 'unknown' for t in file_types)})\n"
+        elif file_type:
             context_str += f"Attached File Type: {file_type}\n"
         if has_youtube:
             context_str += "DeepTube URL detected.\n"
@@ -113,6 +151,8 @@ class AgentPlanner:
           * "analyze this" → assume conversational_answer
           * "rate this resume" → extract_text_from_pdf + conversational_answer
           * "what's in this image" → extract_text_from_image + conversational_answer
+        - MULTIPLE FILES: Each extraction task processes every attached file of its type. Include it once per file type, then one analysis step that covers all files.
+        - SUMMARY ONLY: If the user only wants a summary, end the plan with summarize. Add conversational_answer after summarize only when they also ask something else (e.g., "summarize this resume and tell me if it fits a backend role").
         - ONLY ASK FOR CLARIFICATION if the request is truly impossible to interpret (e.g., "process this" with no file and no context).
         
         Response Format (JSON):
@@ -132,11 +172,11 @@ class AgentPlanner:
         full_prompt = f"{system_prompt}\n\nTask Context:\n{context_str}\n\nGenerate JSON response:"
         
         try:
-            # Use very short timeout for planning
-            import asyncio
-            response_text = await asyncio.wait_for(
-                gemini_service.generate_text(full_prompt),
-                timeout=10.0
+            # Use very short timeout for planning, never more than the request has left
+            response_text = await gemini_service.generate_text(
+                full_prompt,
+                deadline=deadline,
+                timeout=settings.PLANNER_TIMEOUT_S
             )
             # Cleanup code blocks if Gemini adds them
             cleaned_text = response_text.replace("```json", "").replace("```", "").strip()
@@ -1,48 +1,368 @@
 
 from app.services.llm_gemini import gemini_service
+from app.models.schemas import TranscriptSegment
+from app.core.config import settings
 from app.core.logging import logger
+from app.core.deadline import Deadline, DeadlineExceeded, ensure_deadline
+from typing import AsyncIterator, Callable, List, Optional, Tuple, Union
+from io import BytesIO
+import asyncio
+import json
+import math
+import shutil
 import tempfile
+import wave
 import os
 
+# In-memory WAV bytes, or the path of a WAV file on disk (decoded uploads)
+WavSource = Union[bytes, str]
+
 class AudioService:
-    async def process_audio(self, audio_bytes: bytes, filename: str) -> dict:
+    def __init__(self):
+        self._ffmpeg: Optional[str] = None
+
+    def ffmpeg_exe(self) -> Optional[str]:
+        """Bundled ffmpeg binary (imageio-ffmpeg), falling back to one on PATH; None if neither exists"""
+        if self._ffmpeg is None:
+            try:
+                import imageio_ffmpeg
+                self._ffmpeg = imageio_ffmpeg.get_ffmpeg_exe()
+            except (ImportError, RuntimeError):
+                self._ffmpeg = shutil.which("ffmpeg") or ""
+        return self._ffmpeg or None
+
+    def is_wav(self, audio_bytes: bytes, filename: str = "") -> bool:
+        return (audio_bytes[:4] == b"RIFF" and audio_bytes[8:12] == b"WAVE") or filename.lower().endswith(".wav")
+
+    def _open_wav(self, source: WavSource) -> wave.Wave_read:
+        return wave.open(BytesIO(source) if isinstance(source, bytes) else source, "rb")
+
+    def split_wav(
+        self,
+        source: WavSource,
+        segment_s: float = None,
+        overlap_s: float = None
+    ) -> Tuple[float, List[Tuple[float, float]]]:
         """
-        Transcribes and summarizes audio using Gemini.
+        Plans overlapping segment windows over PCM WAV audio from its header; no samples are decoded
+        here. Each window is decoded later with `read_wav_segment`.
+        Returns: (duration_s, [(start_s, end_s), ...])
+        """
+        segment_s = segment_s or settings.AUDIO_SEGMENT_S
+        overlap_s = settings.AUDIO_SEGMENT_OVERLAP_S if overlap_s is None else overlap_s
+        if overlap_s >= segment_s:
+            raise ValueError("Segment overlap must be shorter than the segment")
+
+        with self._open_wav(source) as src:
+            rate = src.getframerate()
+            total_frames = src.getnframes()
+
+        segment_frames = int(segment_s * rate)
+        step_frames = int((segment_s - overlap_s) * rate)
+
+        windows = []
+        start = 0
+        while True:
+            end = min(start + segment_frames, total_frames)
+            windows.append((start / rate, end / rate))
+            if end >= total_frames:
+                break
+            start += step_frames
+        return total_frames / rate, windows
+
+    def read_wav_segment(self, source: WavSource, start_s: float, end_s: float) -> bytes:
+        """Decodes only the frames of one window into a standalone WAV (stdlib decoder, works offline)"""
+        with self._open_wav(source) as src:
+            rate = src.getframerate()
+            start = round(start_s * rate)
+            src.setpos(start)
+            frames = src.readframes(round(end_s * rate) - start)
+            out = BytesIO()
+            with wave.open(out, "wb") as dst:
+                dst.setparams(src.getparams())
+                dst.writeframes(frames)
+        return out.getvalue()
+
+    def stitch_segments(self, segments: List[TranscriptSegment], overlap_s: float = None) -> str:
+        """
+        Joins segment transcripts in order with [mm:ss] timestamps, dropping the words each
+        segment repeats from the overlap with its predecessor.
         """
+        overlap_s = settings.AUDIO_SEGMENT_OVERLAP_S if overlap_s is None else overlap_s
+        # Most words the overlap can hold, allowing for fast speech (~4 words/s)
+        window = max(3, math.ceil(overlap_s * 4))
+
+        lines = []
+        prev_words: List[str] = []
+        for seg in sorted(segments, key=lambda s: s.index):
+            words = seg.text.split()
+            if prev_words and words:
+                words = self._drop_overlap(prev_words, words, window)
+            if not seg.text.strip():
+                lines.append(f"[{self._format_ts(seg.start_s)}] [segment unavailable]")
+            elif words:
+                lines.append(f"[{self._format_ts(seg.start_s)}] {' '.join(words)}")
+            prev_words = seg.text.split()
+        return "\n".join(lines)
+
+    def _drop_overlap(self, prev_words: List[str], words: List[str], window: int) -> List[str]:
+        """
+        Drops the start of `words` that repeats the end of `prev_words`. The repeat must end the
+        previous segment and lie within the overlap window, so phrases recurring later are kept.
+        """
+        tail = [self._norm(w) for w in prev_words[-window:]]
+        head = [self._norm(w) for w in words[:window]]
+        # Longest repeat first; at least two words so a lone common word isn't taken as overlap
+        for size in range(min(len(tail), len(head)), 1, -1):
+            suffix = tail[-size:]
+            for start in range(len(head) - size + 1):
+                if head[start:start + size] == suffix:
+                    return words[start + size:]
+        return words
+
+    def _norm(self, word: str) -> str:
+        return "".join(ch for ch in word.lower() if ch.isalnum())
+
+    def _format_ts(self, seconds: float) -> str:
+        seconds = int(seconds)
+        if seconds >= 3600:
+            return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+        return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+    async def transcribe_segments(
+        self,
+        source: WavSource,
+        windows: List[Tuple[float, float]],
+        deadline: Optional[Deadline] = None
+    ) -> AsyncIterator[TranscriptSegment]:
+        """
+        Transcribes segments concurrently (bounded fan-out) and yields each one as it completes.
+        Raises DeadlineExceeded once the request budget runs out; segments already yielded stand.
+        """
+        semaphore = asyncio.Semaphore(settings.AUDIO_TRANSCRIBE_CONCURRENCY)
+        prompt = "Transcribe this audio verbatim. Output ONLY the transcript text, with no timestamps or commentary."
+
+        async def transcribe(index: int, start_s: float, end_s: float) -> TranscriptSegment:
+            async with semaphore:
+                try:
+                    # Decoded inside the bounded section, so only in-flight segments are held in memory
+                    wav_bytes = await asyncio.to_thread(self.read_wav_segment, source, start_s, end_s)
+                    text = await self._transcribe_clip(wav_bytes, prompt, deadline)
+                except DeadlineExceeded:
+                    raise
+                except Exception as e:
+                    # One bad segment shouldn't lose the whole recording
+                    logger.error(f"Audio segment {index} ({start_s:.0f}s-{end_s:.0f}s) failed: {e}")
+                    text = ""
+                return TranscriptSegment(index=index, start_s=start_s, end_s=end_s, text=text.strip())
+
+        tasks = [asyncio.create_task(transcribe(i, *window)) for i, window in enumerate(windows)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Collect outcomes so failed stragglers don't log "exception never retrieved"
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _transcribe_clip(self, wav_bytes: bytes, prompt: str, deadline: Optional[Deadline]) -> str:
+        # Inline data travels base64-encoded, a third larger than the raw clip
+        if 4 * math.ceil(len(wav_bytes) / 3) <= settings.AUDIO_INLINE_MAX_BYTES:
+            return await gemini_service.generate_from_audio_bytes(wav_bytes, "audio/wav", prompt, deadline=deadline)
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
+            tmp.write(wav_bytes)
+            tmp_path = tmp.name
         try:
-            # Save bytes to temp file because Gemini upload needs path
-            # In production, might use cleaner temp handling
-            # Note: We need a file extension for Gemini to recognize MIME type
-            ext = os.path.splitext(filename)[1]
-            if not ext:
-                ext = ".mp3" # default
-            
-            with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
-                tmp.write(audio_bytes)
-                tmp_path = tmp.name
-
-            # Prompt to get specific format
-            prompt = """
-            Please transcribe this audio and provide a summary.
-            Output ONLY valid JSON with keys:
-            - transcript
-            - one_line_summary
-            - bullet_points (list of 3 strings)
-            - five_sentence_summary
-            - duration (string like '5:30' or '300s')
-            """
-            
-            # Use generation service
-            # We assume gemini_service can handle audio upload
-            response_text = await gemini_service.generate_with_audio(tmp_path, prompt)
-            
-            # Clean up
+            return await gemini_service.generate_with_audio(tmp_path, prompt, deadline=deadline)
+        finally:
             os.unlink(tmp_path)
-            
-            return response_text # Logic to parse JSON goes in task executor
-            
+
+    async def decode_to_wav(self, audio_bytes: bytes, filename: str, deadline: Optional[Deadline] = None) -> Optional[str]:
+        """
+        Decodes any ffmpeg-readable recording (MP3, M4A, WebM, ...) to a mono PCM WAV file on disk,
+        so it can be segmented like an uploaded WAV. Returns the WAV path (caller deletes it),
+        or None if no decoder is available or decoding fails.
+        """
+        ffmpeg = self.ffmpeg_exe()
+        if not ffmpeg:
+            return None
+        ext = os.path.splitext(filename)[1] or ".bin"
+        with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
+            tmp.write(audio_bytes)
+            src_path = tmp.name
+        fd, wav_path = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        proc = None
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                ffmpeg, "-nostdin", "-v", "error", "-y", "-i", src_path,
+                "-vn", "-ac", "1", "-ar", str(settings.AUDIO_DECODE_SAMPLE_RATE), "-c:a", "pcm_s16le", wav_path,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+            _, stderr = await ensure_deadline(deadline).wait_for(proc.communicate())
+            if proc.returncode != 0:
+                logger.warning(f"ffmpeg could not decode {filename}: {stderr.decode(errors='replace').strip()[:200]}")
+                os.unlink(wav_path)
+                return None
+            return wav_path
+        except BaseException:
+            if proc and proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            os.unlink(wav_path)
+            raise
+        finally:
+            os.unlink(src_path)
+
+    async def process_audio(
+        self,
+        audio_bytes: bytes,
+        filename: str,
+        deadline: Optional[Deadline] = None,
+        on_partial: Optional[Callable[[str], None]] = None
+    ) -> dict:
+        """
+        Transcribes and summarizes audio using Gemini.
+        Recordings are split into overlapping segments and transcribed in parallel: PCM WAV
+        directly, other formats after decoding with ffmpeg. `on_partial` receives the transcript
+        of the leading completed segments each time it grows. If the deadline runs out first,
+        the segments finished so far are returned as a partial transcript.
+        Without a decoder, non-WAV audio goes to Gemini in one call.
+        """
+        decoded_path = None
+        try:
+            source: Optional[WavSource] = audio_bytes if self.is_wav(audio_bytes, filename) else None
+            if source is not None:
+                try:
+                    duration_s, windows = self.split_wav(source)
+                except (wave.Error, EOFError) as e:
+                    # Compressed or malformed WAV: try the decoder like any other format
+                    logger.warning(f"Local WAV decode failed: {e}")
+                    source = None
+            if source is None:
+                decoded_path = await self.decode_to_wav(audio_bytes, filename, deadline)
+                if decoded_path:
+                    source = decoded_path
+                    duration_s, windows = self.split_wav(source)
+
+            if source is not None:
+                return await self._process_segmented(source, duration_s, windows, deadline, on_partial)
+
+            logger.warning(f"Could not segment {filename} locally; sending whole file")
+            return await self._process_whole(audio_bytes, filename, deadline)
+
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Audio processing failed: {e}")
             return {"error": str(e)}
+        finally:
+            if decoded_path:
+                os.unlink(decoded_path)
+
+    async def _process_segmented(
+        self,
+        source: WavSource,
+        duration_s: float,
+        windows: List[Tuple[float, float]],
+        deadline: Optional[Deadline],
+        on_partial: Optional[Callable[[str], None]] = None
+    ) -> str:
+        logger.info(f"Transcribing {duration_s:.0f}s of audio in {len(windows)} segments")
+        done: List[TranscriptSegment] = []
+        by_index = {}
+        published = 0
+        partial = False
+        transcribed = self.transcribe_segments(source, windows, deadline=deadline)
+        try:
+            async for seg in transcribed:
+                done.append(seg)
+                by_index[seg.index] = seg
+                logger.info(f"Audio segment {seg.index + 1}/{len(windows)} transcribed")
+                # Segments finish out of order; publish only the gap-free leading run
+                ready = published
+                while ready in by_index:
+                    ready += 1
+                if on_partial and ready > published:
+                    published = ready
+                    on_partial(self.stitch_segments([by_index[i] for i in range(ready)]))
+        except DeadlineExceeded:
+            # Keep what finished; unfinished ranges show up as unavailable in the transcript
+            partial = True
+            finished = {seg.index for seg in done}
+            done += [
+                TranscriptSegment(index=i, start_s=start_s, end_s=end_s, text="")
+                for i, (start_s, end_s) in enumerate(windows) if i not in finished
+            ]
+            logger.warning(f"Deadline reached after {len(finished)}/{len(windows)} audio segments; returning partial transcript")
+        finally:
+            await transcribed.aclose()
+
+        transcript = self.stitch_segments(done)
+        result = {
+            "transcript": transcript,
+            "duration": self._format_ts(duration_s),
+            "segment_count": len(windows)
+        }
+        if partial:
+            # No budget left to summarize
+            result.update({"partial": True, "transcribed_segments": sum(1 for seg in done if seg.text)})
+            return json.dumps(result)
+
+        # Summarize the stitched transcript rather than the raw audio
+        prompt = f"""Summarize this transcript.
+{transcript}
+Output ONLY valid JSON with keys:
+- one_line_summary
+- bullet_points (list of 3 strings)
+- five_sentence_summary"""
+        res = await gemini_service.generate_text(prompt, deadline=deadline)
+        try:
+            summary = json.loads(res.replace("```json", "").replace("```", "").strip())
+        except json.JSONDecodeError:
+            logger.error("Audio summary was not valid JSON")
+            summary = {}
+
+        result.update({
+            "one_line_summary": summary.get("one_line_summary", ""),
+            "bullet_points": summary.get("bullet_points", []),
+            "five_sentence_summary": summary.get("five_sentence_summary", "")
+        })
+        return json.dumps(result) # Same contract as the single-call path: executor parses JSON
+
+    async def _process_whole(self, audio_bytes: bytes, filename: str, deadline: Optional[Deadline]) -> str:
+        # Save bytes to temp file because Gemini upload needs path
+        # In production, might use cleaner temp handling
+        # Note: We need a file extension for Gemini to recognize MIME type
+        ext = os.path.splitext(filename)[1]
+        if not ext:
+            ext = ".mp3" # default
+
+        with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
+            tmp.write(audio_bytes)
+            tmp_path = tmp.name
+
+        # Prompt to get specific format
+        prompt = """
+        Please transcribe this audio and provide a summary.
+        Output ONLY valid JSON with keys:
+        - transcript
+        - one_line_summary
+        - bullet_points (list of 3 strings)
+        - five_sentence_summary
+        - duration (string like '5:30' or '300s')
+        """
+
+        # Use generation service
+        # We assume gemini_service can handle audio upload
+        try:
+            response_text = await gemini_service.generate_with_audio(tmp_path, prompt, deadline=deadline)
+        finally:
+            # Clean up, also when the request is cancelled mid-upload
+            os.unlink(tmp_path)
+
+        return response_text # Logic to parse JSON goes in task executor
 
 audio_service = AudioService()
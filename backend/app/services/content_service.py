@@ -0,0 +1,91 @@
+
+from app.models.schemas import ExtractedContentRef
+from app.core.config import settings
+from app.core.logging import logger
+from collections import OrderedDict
+from typing import Optional
+import hashlib
+
+class ContentService:
+    """
+    Server-side store for extracted text (PDF, OCR, transcripts).
+    Responses carry only a reference; the full text is served separately with range support.
+    """
+    def __init__(self, max_bytes: int = None):
+        # In-memory LRU: {content_id: utf-8 bytes}, bounded by total size
+        self._storage: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self.max_bytes = max_bytes or settings.CONTENT_STORE_MAX_BYTES
+        # Source key (e.g. step name + file hash) -> content_id, so repeat uploads skip extraction
+        self._sources: "OrderedDict[str, str]" = OrderedDict()
+
+    def put(self, text: str) -> ExtractedContentRef:
+        data = text.encode("utf-8")
+        # Content-addressed, so re-extracting the same document reuses the entry
+        content_id = hashlib.sha256(data).hexdigest()[:32]
+        if content_id in self._storage:
+            self._storage.move_to_end(content_id)
+        else:
+            self._storage[content_id] = data
+            self._size += len(data)
+            self._evict()
+        return self._ref(content_id, text, data)
+
+    def put_at(self, content_id: str, text: str) -> ExtractedContentRef:
+        """Stores text under a caller-chosen ID, replacing what was there (e.g. a growing partial transcript)"""
+        data = text.encode("utf-8")
+        previous = self._storage.pop(content_id, None)
+        if previous is not None:
+            self._size -= len(previous)
+        self._storage[content_id] = data
+        self._size += len(data)
+        self._evict()
+        return self._ref(content_id, text, data)
+
+    def get_bytes(self, content_id: str) -> Optional[bytes]:
+        data = self._storage.get(content_id)
+        if data is not None:
+            self._storage.move_to_end(content_id)
+        return data
+
+    def get_text(self, content_id: str) -> Optional[str]:
+        data = self.get_bytes(content_id)
+        return data.decode("utf-8") if data is not None else None
+
+    def remember_source(self, source_key: Optional[str], text: str) -> Optional[ExtractedContentRef]:
+        if not source_key:
+            return None
+        ref = self.put(text)
+        self._sources[source_key] = ref.content_id
+        self._sources.move_to_end(source_key)
+        while len(self._sources) > settings.CONTENT_SOURCE_CACHE_SIZE:
+            self._sources.popitem(last=False)
+        return ref
+
+    def lookup_source(self, source_key: Optional[str]) -> Optional[str]:
+        """Previously extracted text for this source, if it is still stored"""
+        content_id = self._sources.get(source_key) if source_key else None
+        if content_id is None:
+            return None
+        text = self.get_text(content_id)
+        if text is None:
+            # Content was evicted; forget the mapping too
+            del self._sources[source_key]
+        return text
+
+    def _ref(self, content_id: str, text: str, data: bytes) -> ExtractedContentRef:
+        return ExtractedContentRef(
+            content_id=content_id,
+            length=len(text),
+            byte_length=len(data),
+            preview=text[:settings.CONTENT_PREVIEW_CHARS]
+        )
+
+    def _evict(self):
+        # Always keep the newest entry, even if it alone exceeds the budget
+        while self._size > self.max_bytes and len(self._storage) > 1:
+            content_id, data = self._storage.popitem(last=False)
+            self._size -= len(data)
+            logger.info(f"Evicted extracted content {content_id} ({len(data)} bytes)")
+
+content_service = ContentService()
@@ -0,0 +1,236 @@
+
+from app.core.config import settings
+from app.core.logging import logger
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Union
+import asyncio
+import base64
+import httpx
+import time
+
+class GeminiTransportError(Exception):
+    """Non-success response from the Gemini REST API"""
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"Gemini API error {status_code}: {message}")
+        self.status_code = status_code
+
+class InlineBlob:
+    """Binary part sent inline with the request (small images / audio clips)"""
+    def __init__(self, mime_type: str, data: bytes):
+        self.mime_type = mime_type
+        self.data = data
+
+class UploadedFile:
+    """Reference to a file stored with the Gemini Files API"""
+    def __init__(self, uri: str, mime_type: str, name: str):
+        self.uri = uri
+        self.mime_type = mime_type
+        self.name = name
+
+Part = Union[str, InlineBlob, UploadedFile]
+
+class GeminiTransport:
+    """
+    Async-native REST transport for Gemini.
+    Keeps one pooled httpx client with persistent keep-alive connections, so TLS setup is paid
+    once per connection rather than per request. Blocking work (file reads, image decoding)
+    goes to a dedicated thread pool instead of the event loop.
+    Point `base_url` at a local HTTP stand-in to test without the real API.
+    """
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = None,
+        pool_size: int = None,
+        keepalive_s: float = None,
+        blocking_workers: int = None
+    ):
+        self.api_key = api_key
+        self.base_url = (base_url or settings.GEMINI_API_BASE_URL).rstrip("/")
+        self.pool_size = pool_size or settings.GEMINI_POOL_SIZE
+        self.keepalive_s = keepalive_s or settings.GEMINI_KEEPALIVE_S
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop = None
+        self.blocking_workers = blocking_workers or settings.GEMINI_BLOCKING_WORKERS
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stats = {
+            "requests": 0,
+            "new_connections": 0,
+            "reused_connections": 0,
+            "errors": 0,
+            "queue_ms_total": 0.0,
+            "queue_ms_max": 0.0
+        }
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        # Pooled connections belong to the loop that opened them; start a fresh pool on a new loop
+        if self._client is None or self._client.is_closed or loop is not self._loop:
+            self._close_stale_client()
+            self._loop = loop
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"x-goog-api-key": self.api_key},
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                    keepalive_expiry=self.keepalive_s
+                ),
+                timeout=httpx.Timeout(settings.LLM_CALL_TIMEOUT_S, connect=settings.GEMINI_CONNECT_TIMEOUT_S)
+            )
+        return self._client
+
+    def _close_stale_client(self):
+        """Closes the pool opened on a previous event loop; its connections can't be used from this one"""
+        old, old_loop = self._client, self._loop
+        self._client = None
+        if old is None or old.is_closed:
+            return
+        if old_loop is not None and old_loop.is_running():
+            asyncio.run_coroutine_threadsafe(old.aclose(), old_loop)
+        else:
+            # The loop that owned the sockets is gone, and its transports with it
+            logger.info("Dropping Gemini connection pool from a stopped event loop")
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.blocking_workers, thread_name_prefix="gemini-blocking")
+        return self._executor
+
+    async def run_blocking(self, fn: Callable, *args) -> Any:
+        """Runs a blocking call on the transport's thread pool"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def generate(self, model: str, parts: List[Part]) -> str:
+        payload = {"contents": [{"role": "user", "parts": [self._encode_part(p) for p in parts]}]}
+        data = await self._request("POST", f"/v1beta/models/{model}:generateContent", json=payload)
+        candidates = data.get("candidates") or []
+        if not candidates:
+            reason = (data.get("promptFeedback") or {}).get("blockReason", "no candidates returned")
+            raise ValueError(f"Gemini returned no text: {reason}")
+        return "".join(p.get("text", "") for p in candidates[0].get("content", {}).get("parts", []))
+
+    async def upload(self, data: bytes, mime_type: str, display_name: str = "upload") -> UploadedFile:
+        """Uploads through the Files API resumable protocol and waits until the file is usable"""
+        start = await self._request(
+            "POST",
+            "/upload/v1beta/files",
+            json={"file": {"display_name": display_name}},
+            headers={
+                "X-Goog-Upload-Protocol": "resumable",
+                "X-Goog-Upload-Command": "start",
+                "X-Goog-Upload-Header-Content-Length": str(len(data)),
+                "X-Goog-Upload-Header-Content-Type": mime_type
+            },
+            raw=True
+        )
+        upload_url = start.headers.get("x-goog-upload-url")
+        if not upload_url:
+            raise GeminiTransportError(start.status_code, "upload URL missing from start response")
+
+        info = (await self._request(
+            "POST",
+            upload_url,
+            content=data,
+            headers={"X-Goog-Upload-Command": "upload, finalize", "X-Goog-Upload-Offset": "0"}
+        ))["file"]
+        while info.get("state") == "PROCESSING":
+            await asyncio.sleep(settings.GEMINI_UPLOAD_POLL_S)
+            info = await self._request("GET", f"/v1beta/{info['name']}")
+        if info.get("state") == "FAILED":
+            raise GeminiTransportError(500, f"file processing failed for {info.get('name')}")
+        return UploadedFile(info["uri"], info.get("mimeType", mime_type), info.get("name", ""))
+
+    async def warm_up(self, model: str, connections: int = 1):
+        """Opens pooled connections ahead of the first user request (DNS, TCP and TLS setup)"""
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(self._request("GET", f"/v1beta/models/{model}") for _ in range(connections)),
+            return_exceptions=True
+        )
+        failures = [r for r in results if isinstance(r, Exception)]
+        if failures:
+            logger.warning(f"Gemini warm-up: {len(failures)}/{connections} requests failed: {failures[0]}")
+        logger.info(f"Gemini warm-up finished in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> dict:
+        requests = self._stats["requests"]
+        reused = self._stats["reused_connections"]
+        return {
+            "requests": requests,
+            "new_connections": self._stats["new_connections"],
+            "reused_connections": reused,
+            "reuse_ratio": round(reused / requests, 3) if requests else 0.0,
+            "errors": self._stats["errors"],
+            "avg_queue_ms": round(self._stats["queue_ms_total"] / requests, 2) if requests else 0.0,
+            "max_queue_ms": round(self._stats["queue_ms_max"], 2),
+            "pool_size": self.pool_size,
+            "keepalive_s": self.keepalive_s
+        }
+
+    def _encode_part(self, part: Part) -> Dict[str, Any]:
+        if isinstance(part, str):
+            return {"text": part}
+        if isinstance(part, InlineBlob):
+            return {"inline_data": {"mime_type": part.mime_type, "data": base64.b64encode(part.data).decode("ascii")}}
+        if isinstance(part, UploadedFile):
+            return {"file_data": {"mime_type": part.mime_type, "file_uri": part.uri}}
+        raise TypeError(f"Unsupported Gemini part: {type(part).__name__}")
+
+    async def _request(self, method: str, url: str, raw: bool = False, **kwargs) -> Any:
+        timings: Dict[str, float] = {}
+
+        async def trace(event: str, info: dict):
+            # httpcore reports connection setup only for new connections; the rest is pool wait
+            now = time.perf_counter()
+            if event == "connection.connect_tcp.started":
+                timings["connect_started"] = now
+            elif event in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+                timings["connect_done"] = now
+            elif event.endswith("send_request_headers.started"):
+                timings.setdefault("headers_started", now)
+
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, extensions={"trace": trace}, **kwargs)
+        except asyncio.CancelledError:
+            self._record(started, timings, ok=False, error=False)
+            raise
+        except Exception:
+            self._record(started, timings, ok=False)
+            raise
+        self._record(started, timings, ok=response.status_code < 400)
+
+        if response.status_code >= 400:
+            try:
+                message = response.json().get("error", {}).get("message", response.text)
+            except ValueError:
+                message = response.text
+            raise GeminiTransportError(response.status_code, message)
+        return response if raw else response.json()
+
+    def _record(self, started: float, timings: Dict[str, float], ok: bool, error: bool = True):
+        self._stats["requests"] += 1
+        if not ok and error:
+            self._stats["errors"] += 1
+        connect_s = 0.0
+        if "connect_started" in timings:
+            self._stats["new_connections"] += 1
+            connect_s = timings.get("connect_done", timings["connect_started"]) - timings["connect_started"]
+        elif ok:
+            # Failed requests may never have had a connection, so only successes count as reuse
+            self._stats["reused_connections"] += 1
+        if "headers_started" in timings:
+            queue_ms = max(0.0, (timings["headers_started"] - started - connect_s) * 1000)
+            self._stats["queue_ms_total"] += queue_ms
+            self._stats["queue_ms_max"] = max(self._stats["queue_ms_max"], queue_ms)
@@ -1,36 +1,62 @@
 
-import google.generativeai as genai
 from app.core.config import settings
 from app.core.logging import logger
-from typing import Optional, List, Dict, Any
-import json
+from app.core.deadline import Deadline, DeadlineExceeded, ensure_deadline
+from app.services.gemini_transport import GeminiTransport, InlineBlob, Part
+from typing import Optional, List, Dict, Any, Tuple
 import asyncio
+import mimetypes
+import os
+
+# Formats Gemini accepts inline as-is; anything else PIL can read is re-encoded as PNG
+GEMINI_IMAGE_FORMATS = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+def _prepare_image(image_bytes: bytes) -> Tuple[str, bytes]:
+    """Decodes the image header (and re-encodes if needed). Blocking: run on the transport's pool."""
+    from PIL import Image
+    import io
+
+    image = Image.open(io.BytesIO(image_bytes))
+    if image.format in GEMINI_IMAGE_FORMATS:
+        return GEMINI_IMAGE_FORMATS[image.format], image_bytes
+    out = io.BytesIO()
+    image.convert("RGBA" if "A" in image.getbands() else "RGB").save(out, format="PNG")
+    return "image/png", out.getvalue()
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
 
 class GeminiService:
     def __init__(self):
+        self.model_name = settings.GEMINI_MODEL
         if settings.GEMINI_API_KEY:
-            genai.configure(api_key=settings.GEMINI_API_KEY)
-            
-            self.model = genai.GenerativeModel('gemini-2.5-flash') 
-            self.vision_model = genai.GenerativeModel('gemini-2.5-flash')
+            self.transport: Optional[GeminiTransport] = GeminiTransport(settings.GEMINI_API_KEY)
         else:
             logger.warning("GEMINI_API_KEY not set. Gemini service will fail if used.")
-            self.model = None
+            self.transport = None
 
-    async def generate_text(self, prompt: str) -> str:
-        if not self.model:
+    async def _generate(self, parts: List[Part], deadline: Deadline, timeout: float) -> str:
+        if not self.transport:
             raise ValueError("Gemini API Key not set")
+        # Bounded by the per-call timeout and the remaining request budget
+        return await deadline.wait_for(self.transport.generate(self.model_name, parts), cap=timeout)
+
+    async def generate_text(self, prompt: str, deadline: Optional[Deadline] = None, timeout: Optional[float] = None) -> str:
+        if not self.transport:
+            raise ValueError("Gemini API Key not set")
+        deadline = ensure_deadline(deadline)
+        timeout = timeout or settings.LLM_CALL_TIMEOUT_S
         try:
-            logger.info(f"Making Gemini API call with model: gemini-2.5-flash")
-            # Add timeout to prevent hanging
-            response = await asyncio.wait_for(
-                self.model.generate_content_async(prompt),
-                timeout=60.0
-            )
-            logger.info(f"Gemini API call successful, response length: {len(response.text)}")
-            return response.text
+            logger.info(f"Making Gemini API call with model: {self.model_name}")
+            text = await self._generate([prompt], deadline, timeout)
+            logger.info(f"Gemini API call successful, response length: {len(text)}")
+            return text
+        except DeadlineExceeded:
+            logger.error("Gemini request cancelled: request deadline exceeded")
+            raise
         except asyncio.TimeoutError:
-            logger.error("Gemini request timed out after 60 seconds")
+            logger.error(f"Gemini request timed out after {timeout:.0f} seconds")
             raise Exception("Request timed out - model is too slow")
         except Exception as e:
             logger.error(f"Gemini generation error: {type(e).__name__}: {e}")
@@ -38,33 +64,54 @@ class GeminiService:
             logger.error(f"API Key length: {len(settings.GEMINI_API_KEY) if settings.GEMINI_API_KEY else 0}")
             raise e
 
-    async def generate_with_audio(self, audio_file_path: str, prompt: str) -> str:
-        # Placeholder for native audio support
-        # logic: upload file to gemini, then prompting
-        # efficient implementation:
-        if not self.model:
+    async def generate_with_audio(self, audio_file_path: str, prompt: str, deadline: Optional[Deadline] = None) -> str:
+        # Large audio goes through the Files API, then is referenced in the prompt
+        if not self.transport:
              raise ValueError("Gemini API Key not set")
+        deadline = ensure_deadline(deadline)
         try:
-            # Upload the file
-            audio_file = genai.upload_file(path=audio_file_path)
-            response = await self.model.generate_content_async([prompt, audio_file])
-            return response.text
+            audio_bytes = await self.transport.run_blocking(_read_file, audio_file_path)
+            mime_type = mimetypes.guess_type(audio_file_path)[0] or "audio/mpeg"
+            audio_file = await deadline.wait_for(
+                self.transport.upload(audio_bytes, mime_type, os.path.basename(audio_file_path))
+            )
+            return await self._generate([prompt, audio_file], deadline, settings.LLM_CALL_TIMEOUT_S)
         except Exception as e:
              logger.error(f"Gemini audio generation error: {e}")
              raise e
 
-    async def generate_from_image(self, image_bytes: bytes, prompt: str) -> str:
-        if not self.vision_model:
+    async def generate_from_audio_bytes(self, audio_bytes: bytes, mime_type: str, prompt: str, deadline: Optional[Deadline] = None) -> str:
+        # Inline audio skips the upload round trip; only for small clips (request limit ~20MB)
+        if not self.transport:
+             raise ValueError("Gemini API Key not set")
+        deadline = ensure_deadline(deadline)
+        try:
+            return await self._generate([prompt, InlineBlob(mime_type, audio_bytes)], deadline, settings.LLM_CALL_TIMEOUT_S)
+        except Exception as e:
+             logger.error(f"Gemini inline audio generation error: {e}")
+             raise e
+
+    async def generate_from_image(self, image_bytes: bytes, prompt: str, deadline: Optional[Deadline] = None) -> str:
+        if not self.transport:
             raise ValueError("Gemini API Key not set")
+        deadline = ensure_deadline(deadline)
         try:
-            from PIL import Image
-            import io
-            
-            image = Image.open(io.BytesIO(image_bytes))
-            response = await self.vision_model.generate_content_async([prompt, image])
-            return response.text
+            # PIL decoding is CPU-bound; keep it off the event loop
+            mime_type, data = await self.transport.run_blocking(_prepare_image, image_bytes)
+            return await self._generate([prompt, InlineBlob(mime_type, data)], deadline, settings.LLM_CALL_TIMEOUT_S)
         except Exception as e:
             logger.error(f"Gemini vision generation error: {e}")
             raise e
 
+    async def warm_up(self):
+        if self.transport and settings.GEMINI_WARMUP:
+            await self.transport.warm_up(self.model_name, settings.GEMINI_WARMUP_CONNECTIONS)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.transport.stats() if self.transport else {"configured": False}
+
+    async def aclose(self):
+        if self.transport:
+            await self.transport.aclose()
+
 gemini_service = GeminiService()
@@ -1,8 +1,10 @@
 from app.services.llm_gemini import gemini_service
 from app.core.logging import logger
+from app.core.deadline import Deadline, DeadlineExceeded
+from typing import Optional
 
 class OCRService:
-    async def extract_text(self, image_bytes: bytes) -> tuple[str, float]:
+    async def extract_text(self, image_bytes: bytes, deadline: Optional[Deadline] = None) -> tuple[str, float]:
         """
         Extracts text from image bytes using Gemini Vision.
         Returns: (extracted_text, confidence_score)
@@ -11,12 +13,15 @@ class OCRService:
             # We use Gemini 1.5 Flash for fast OCR
             text = await gemini_service.generate_from_image(
                 image_bytes, 
-                "Extract all visible text from this image. Output ONLY the extracted text. Maintain layout if possible."
+                "Extract all visible text from this image. Output ONLY the extracted text. Maintain layout if possible.",
+                deadline=deadline
             )
             
             # Confidence is hard to get from LLM, so we assume high if successful
             return text.strip(), 0.95
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"OCR (Gemini) failed: {e}")
             return "", 0.0
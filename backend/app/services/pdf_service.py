@@ -2,9 +2,12 @@
 import pdfplumber
 from io import BytesIO
 from app.core.logging import logger
+from app.core.deadline import Deadline, DeadlineExceeded, ensure_deadline
+from typing import Optional
+import asyncio
 
 class PDFService:
-    def extract_text(self, pdf_bytes: bytes) -> tuple[str, float]:
+    def extract_text(self, pdf_bytes: bytes, deadline: Optional[Deadline] = None) -> tuple[str, float]:
         """
         Extracts text from PDF bytes.
         Returns: (extracted_text, confidence_score)
@@ -13,6 +16,9 @@ class PDFService:
             text_content = []
             with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
                 for page in pdf.pages:
+                    # Cooperative cancellation: stop between pages once the budget is spent
+                    if deadline and deadline.expired:
+                        raise DeadlineExceeded("Request deadline exceeded during PDF extraction")
                     text = page.extract_text()
                     if text:
                         text_content.append(text)
@@ -23,8 +29,15 @@ class PDFService:
             
             # TODO: Fallback to OCR if text is empty (omitted for brevity, can call ocr_service)
             return full_text, confidence
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"PDF extraction failed: {e}")
             return "", 0.0
 
+    async def extract_text_async(self, pdf_bytes: bytes, deadline: Optional[Deadline] = None) -> tuple[str, float]:
+        """Runs extraction in a worker thread, bounded by the request deadline"""
+        deadline = ensure_deadline(deadline)
+        return await deadline.wait_for(asyncio.to_thread(self.extract_text, pdf_bytes, deadline))
+
 pdf_service = PDFService()
@@ -0,0 +1,108 @@
+
+from app.models.schemas import PlanStep
+from app.services.step_handlers import ExecutionContext, StepRegistry, step_registry
+from app.core.logging import logger
+from typing import List, Tuple
+
+class PlanOptimizer:
+    """
+    Validates a planner-generated plan against the step registry before execution.
+    Drops unknown, duplicate, unsatisfiable and redundant steps, and reuses extracted
+    text already available from the conversation history or the extraction cache.
+    Skipped steps stay in the plan with status "skipped" so the UI can show why.
+    """
+    def __init__(self, registry: StepRegistry = step_registry):
+        self.registry = registry
+
+    def optimize(self, plan: List[PlanStep], ctx: ExecutionContext) -> Tuple[List[PlanStep], List[str]]:
+        """
+        Returns: (plan with skipped steps marked, decisions)
+        Reused content is preloaded into `ctx`.
+        """
+        cost_before = sum(self._cost(step.name) for step in plan)
+        available = ctx.available_inputs()
+        produced = set()
+        seen = set()
+        decisions = []
+        history_reused = False
+        # History only stands in for extraction when this turn brings nothing new to extract
+        can_extract = any(
+            "extracted_text" in handler.outputs and handler.inputs <= available
+            for handler in (self.registry.get(step.name) for step in plan) if handler
+        )
+        reuse_history = not ctx.files and not can_extract
+
+        def skip(step: PlanStep, reason: str):
+            step.status = "skipped"
+            decisions.append(f"skipped {step.name}: {reason}")
+
+        for step in plan:
+            handler = self.registry.get(step.name)
+            if handler is None:
+                skip(step, "unknown step")
+                continue
+            if step.name in seen:
+                skip(step, "duplicate step")
+                continue
+
+            missing = handler.inputs - available
+            if missing:
+                # Follow-up on earlier content: extraction has nothing to read, history already has the text
+                if reuse_history and "extracted_text" in handler.outputs and "history_content" in available and not history_reused:
+                    ctx.add_extracted(ctx.history_content())
+                    history_reused = True
+                    produced |= {"extracted_text"}
+                    available |= {"extracted_text"}
+                    skip(step, "reusing extracted content from conversation history")
+                else:
+                    skip(step, f"missing input {', '.join(sorted(missing))}")
+                continue
+
+            cached = handler.cached_extractions(ctx)
+            if cached is not None:
+                for label, text in cached:
+                    ctx.add_extracted(text, label=label)
+                seen.add(step.name)
+                produced |= handler.outputs
+                available |= handler.outputs
+                skip(step, "reusing cached extraction")
+                continue
+
+            reason = handler.redundant(ctx, produced)
+            if reason:
+                skip(step, reason)
+                continue
+
+            seen.add(step.name)
+            produced |= handler.outputs
+            available |= handler.outputs
+
+        runnable = [step for step in plan if step.status != "skipped"]
+        if not runnable and not produced and self.registry.get("conversational_answer"):
+            # Everything was unsatisfiable; still give the user a reply
+            plan = plan + [PlanStep(name="conversational_answer", description="Fallback reply")]
+            decisions.append("added conversational_answer: no runnable steps left")
+
+        runnable_names = {step.name for step in plan if step.status != "skipped"}
+        if (
+            len(ctx.files_of("audio")) > 1
+            and "transcribe_audio" in runnable_names
+            and not runnable_names & {"summarize", "conversational_answer"}
+        ):
+            # Per-file audio results alone leave the user without one answer over all recordings
+            plan = plan + [PlanStep(name="summarize", description="Summarize all recordings together")]
+            decisions.append("added summarize: combine transcripts of several audio files")
+
+        if decisions:
+            runnable = [step for step in plan if step.status != "skipped"]
+            cost_after = sum(self._cost(step.name) for step in runnable)
+            for decision in decisions:
+                logger.info(f"Plan optimizer: {decision}")
+            logger.info(f"Plan optimizer: running {len(runnable)} of {len(plan)} steps, cost {cost_before} -> {cost_after}")
+        return plan, decisions
+
+    def _cost(self, name: str) -> int:
+        handler = self.registry.get(name)
+        return handler.cost if handler else 0
+
+plan_optimizer = PlanOptimizer()
@@ -0,0 +1,462 @@
+
+from app.models.schemas import LogEntry
+from app.services.llm_gemini import gemini_service
+from app.services.ocr_service import ocr_service
+from app.services.pdf_service import pdf_service
+from app.services.youtube_service import youtube_service
+from app.services.audio_service import audio_service
+from app.services.content_service import content_service
+from app.core.config import settings
+from app.core.deadline import Deadline, DeadlineExceeded
+from typing import Dict, FrozenSet, List, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import os
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp", ".tiff"}
+AUDIO_EXTENSIONS = {".mp3", ".wav", ".m4a", ".ogg", ".flac", ".aac", ".webm"}
+
+def file_kind(file_type: Optional[str], file_name: Optional[str]) -> Optional[str]:
+    """Classifies an upload as "pdf", "image" or "audio" from its MIME type, falling back to the extension"""
+    file_type = file_type or ""
+    ext = os.path.splitext(file_name or "")[1].lower()
+    if "pdf" in file_type or ext == ".pdf":
+        return "pdf"
+    if "image" in file_type or ext in IMAGE_EXTENSIONS:
+        return "image"
+    if "audio" in file_type or ext in AUDIO_EXTENSIONS:
+        return "audio"
+    return None
+
+class InputFile:
+    """One uploaded file"""
+    def __init__(self, name: Optional[str], content_type: Optional[str], data: bytes):
+        self.filename = name # As uploaded; may be None
+        self.name = name or "upload" # For labels and logs
+        self.content_type = content_type
+        self.data = data
+        self.kind = file_kind(content_type, name)
+        self._hash: Optional[str] = None
+
+    @property
+    def hash(self) -> str:
+        if self._hash is None:
+            self._hash = hashlib.sha256(self.data).hexdigest()
+        return self._hash
+
+class ExtractionPools:
+    """Per-file-type concurrency limits shared by all requests on the event loop"""
+    def __init__(self):
+        self._loop = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def get(self, kind: str) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Semaphores bind to a loop; rebuild them if the app runs on a new one (e.g. tests)
+            self._loop = loop
+            self._semaphores = {
+                "pdf": asyncio.Semaphore(settings.EXTRACT_POOL_PDF),
+                "image": asyncio.Semaphore(settings.EXTRACT_POOL_IMAGE),
+                "audio": asyncio.Semaphore(settings.EXTRACT_POOL_AUDIO)
+            }
+        return self._semaphores[kind]
+
+extraction_pools = ExtractionPools()
+
+class ExecutionContext:
+    """State that flows between plan steps"""
+    def __init__(
+        self,
+        text: str,
+        files: Optional[List[InputFile]] = None,
+        conversation_history: Optional[list] = None,
+        deadline: Optional[Deadline] = None,
+        file_bytes: Optional[bytes] = None,
+        file_name: Optional[str] = None,
+        file_type: Optional[str] = None,
+        progress_id: Optional[str] = None
+    ):
+        self.text = text # Raw user text
+        # Single-file callers can still pass the raw bytes
+        if files is None and file_bytes:
+            files = [InputFile(file_name, file_type, file_bytes)]
+        self.files: List[InputFile] = files or []
+        self.conversation_history = conversation_history or []
+        self.deadline = deadline
+        self.extracted_text = "" # From OCR/PDF/Youtube, accumulated across steps
+        self.last_extracted = "" # Most recent extraction
+        self.sections: List[str] = [] # One entry per extracted source, labelled when there are several files
+        self.final_output: Dict = {}
+        self.task_type = "general"
+        self.incomplete = False # A step returned partial results because the deadline ran out
+        self.progress_id = progress_id # Content ID the client polls for partial results while the run is going
+        self._progress: Dict[str, str] = {}
+
+    def files_of(self, kind: str) -> List[InputFile]:
+        return [f for f in self.files if f.kind == kind]
+
+    def available_inputs(self) -> set:
+        """Facts known before any step runs, matched against handler inputs"""
+        facts = set()
+        if self.text.strip():
+            facts.add("text")
+        for f in self.files:
+            if f.kind:
+                facts.add(f"file:{f.kind}")
+        if "youtube.com" in self.text or "youtu.be" in self.text:
+            facts.add("youtube_url")
+        if self.history_content():
+            facts.add("history_content")
+        return facts
+
+    def history_content(self) -> str:
+        for msg in reversed(self.conversation_history):
+            if msg.get("extracted_content"):
+                return msg["extracted_content"]
+        return ""
+
+    def add_extracted(self, text: str, label: Optional[str] = None):
+        # Label each file's text so one downstream prompt can tell the files apart
+        if label and len(self.files) > 1:
+            text = f"=== {label} ===\n{text}"
+        self.extracted_text += f"\n{text}"
+        self.last_extracted = text
+        self.sections.append(text)
+
+    def publish_progress(self, label: str, text: str):
+        """Stores the latest partial output of one source where the client can read it mid-run"""
+        if not self.progress_id:
+            return
+        self._progress[label] = text
+        if len(self._progress) > 1:
+            combined = "\n\n".join(f"=== {name} ===\n{part}" for name, part in self._progress.items())
+        else:
+            combined = text
+        content_service.put_at(self.progress_id, combined)
+
+    def extracted_for_response(self) -> str:
+        return "\n\n".join(self.sections) if len(self.sections) > 1 else self.last_extracted
+
+def parse_json_output(res: str) -> dict:
+    return json.loads(res.replace("```json", "").replace("```", "").strip())
+
+class StepHandler:
+    """
+    One plan step. Handlers declare what they need (`inputs`), what they produce (`outputs`)
+    and a relative `cost`, which the plan optimizer uses to drop wasted steps.
+    Consecutive `concurrent` steps are independent of each other and run together.
+    """
+    name: str = ""
+    inputs: FrozenSet[str] = frozenset()
+    outputs: FrozenSet[str] = frozenset()
+    cost: int = 1
+    concurrent: bool = False
+
+    def describe(self, ctx: ExecutionContext) -> str:
+        return "Processing..."
+
+    def cached_extractions(self, ctx: ExecutionContext) -> Optional[List[Tuple[Optional[str], str]]]:
+        """(label, text) for everything this step would extract, if all of it is cached; else None"""
+        return None
+
+    def redundant(self, ctx: ExecutionContext, produced: set) -> Optional[str]:
+        """Reason to skip this step given what earlier steps produce; None if it still adds something"""
+        if self.outputs and self.outputs <= produced:
+            return f"{', '.join(sorted(self.outputs))} already produced by earlier steps"
+        return None
+
+    async def run(self, ctx: ExecutionContext, log: LogEntry) -> None:
+        raise NotImplementedError
+
+class FileExtractionHandler(StepHandler):
+    """Extracts every uploaded file of one kind concurrently, bounded by that kind's pool"""
+    kind: str = ""
+    label: str = ""
+    action: str = ""
+    purpose: str = ""
+    concurrent = True
+
+    def describe(self, ctx):
+        names = ", ".join(f.name for f in ctx.files_of(self.kind))
+        return f"{self.action} {self.label}: {names or 'uploaded ' + self.label}"
+
+    def source_key(self, f: InputFile) -> Optional[str]:
+        return f"{self.name}:{f.hash}"
+
+    def cached_extractions(self, ctx):
+        files = ctx.files_of(self.kind)
+        cached = [content_service.lookup_source(self.source_key(f)) for f in files]
+        if not files or any(text is None for text in cached):
+            return None
+        return [(f.name, text) for f, text in zip(files, cached)]
+
+    async def extract(self, ctx: ExecutionContext, f: InputFile) -> Tuple[str, str]:
+        """Returns: (extracted_text, output_summary)"""
+        raise NotImplementedError
+
+    async def _extract_one(self, ctx: ExecutionContext, f: InputFile) -> Tuple[str, str]:
+        cached = content_service.lookup_source(self.source_key(f))
+        if cached is not None:
+            return cached, f"Reused cached extraction ({len(cached)} characters)"
+        async with extraction_pools.get(self.kind):
+            txt, summary = await self.extract(ctx, f)
+        if txt:
+            content_service.remember_source(self.source_key(f), txt)
+        return txt, summary
+
+    async def run(self, ctx, log):
+        files = ctx.files_of(self.kind)
+        if not files:
+            log.status = "failed"
+            log.output_summary = f"No {self.label} file provided for {self.purpose}"
+            return
+        # Wall time tracks the slowest file rather than the sum
+        results = await asyncio.gather(*(self._extract_one(ctx, f) for f in files), return_exceptions=True)
+        summaries = []
+        for f, result in zip(files, results):
+            if isinstance(result, DeadlineExceeded):
+                raise result
+            if isinstance(result, Exception):
+                # One unreadable file shouldn't sink the others
+                summaries.append(f"{f.name}: failed ({result})")
+                continue
+            txt, summary = result
+            ctx.add_extracted(txt, label=f.name)
+            summaries.append(f"{f.name}: {summary}" if len(files) > 1 else summary)
+        log.output_summary = "; ".join(summaries)
+        if all(isinstance(result, Exception) for result in results):
+            log.status = "failed"
+
+class ExtractImageTextHandler(FileExtractionHandler):
+    name = "extract_text_from_image"
+    inputs = frozenset({"file:image"})
+    outputs = frozenset({"extracted_text", "image_text"})
+    cost = 3
+    kind = "image"
+    label = "image"
+    action = "Extracting text from"
+    purpose = "text extraction"
+
+    async def extract(self, ctx, f):
+        txt, conf = await ocr_service.extract_text(f.data, deadline=ctx.deadline)
+        return txt, f"Successfully extracted {len(txt)} characters with {conf:.1%} confidence"
+
+class ExtractPdfTextHandler(FileExtractionHandler):
+    name = "extract_text_from_pdf"
+    inputs = frozenset({"file:pdf"})
+    outputs = frozenset({"extracted_text", "pdf_text"})
+    cost = 2
+    kind = "pdf"
+    label = "PDF"
+    action = "Extracting text from"
+    purpose = "text extraction"
+
+    async def extract(self, ctx, f):
+        txt, conf = await pdf_service.extract_text_async(f.data, deadline=ctx.deadline)
+        return txt, f"Successfully extracted {len(txt)} characters from PDF"
+
+class FetchYoutubeTranscriptHandler(StepHandler):
+    name = "fetch_youtube_transcript"
+    inputs = frozenset({"youtube_url"})
+    outputs = frozenset({"extracted_text", "youtube_transcript"})
+    cost = 2
+    concurrent = True
+
+    def _source_key(self, ctx: ExecutionContext) -> Optional[str]:
+        video_id = youtube_service.extract_video_id(ctx.text)
+        return f"{self.name}:{video_id}" if video_id else None
+
+    def cached_extractions(self, ctx):
+        cached = content_service.lookup_source(self._source_key(ctx))
+        return [(None, cached)] if cached is not None else None
+
+    async def run(self, ctx, log):
+        url = ctx.text # Simplification: assume URL in text
+        txt, success = await youtube_service.get_transcript_async(url, deadline=ctx.deadline)
+        if success:
+            ctx.add_extracted(txt)
+            content_service.remember_source(self._source_key(ctx), txt)
+            log.output_summary = "Transcript fetched"
+        else:
+            log.status = "failed"
+            log.output_summary = txt
+
+class TranscribeAudioHandler(FileExtractionHandler):
+    name = "transcribe_audio"
+    inputs = frozenset({"file:audio"})
+    # Audio processing usually returns a summary too, but not always (parse failures, partial
+    # transcripts, several sources), so summarize decides at run time whether it still has work
+    outputs = frozenset({"extracted_text", "transcript"})
+    cost = 5
+    kind = "audio"
+    label = "audio"
+    action = "Transcribing"
+    purpose = "transcription"
+
+    def source_key(self, f):
+        # The summary isn't cached, so always process audio
+        return None
+
+    async def extract(self, ctx, f):
+        resp = await audio_service.process_audio(
+            f.data,
+            f.filename or "audio.mp3",
+            deadline=ctx.deadline,
+            on_partial=lambda transcript: ctx.publish_progress(f.name, transcript)
+        )
+        if isinstance(resp, dict):
+            raise ValueError(resp.get("error", "Audio processing failed"))
+        try:
+            # If audio service returns raw JSON string from LLM (possibly in a ```json fence)
+            audio_data = parse_json_output(resp)
+            if not isinstance(audio_data, dict):
+                raise ValueError("Audio response is not a JSON object")
+        except:
+            return resp, f"Audio transcribed - {len(resp)} characters extracted"
+        transcript = audio_data.pop("transcript", "") # Returned by reference like other extracted content
+        partial = audio_data.pop("partial", False)
+        if partial:
+            ctx.incomplete = True
+        if len(ctx.files_of(self.kind)) == 1:
+            ctx.final_output.update(audio_data)
+        else:
+            ctx.final_output.setdefault("audio_files", []).append({"file": f.name, **audio_data})
+        ctx.task_type = "audio_summary"
+        if partial:
+            return transcript, (
+                f"Partial transcript: {audio_data.get('transcribed_segments', 0)}/{audio_data.get('segment_count', 0)} "
+                f"segments before the request deadline - {len(transcript)} characters extracted"
+            )
+        return transcript, f"Successfully transcribed audio - {len(transcript)} characters extracted"
+
+class SummarizeHandler(StepHandler):
+    name = "summarize"
+    outputs = frozenset({"summary"})
+    cost = 3
+
+    async def run(self, ctx, log):
+        # Audio processing already summarized the only source
+        if ctx.final_output.get("one_line_summary") and len(ctx.sections) == 1:
+            log.output_summary = "Reused summary from audio processing"
+            return
+        content = ctx.extracted_text or ctx.text
+        prompt = f"Summarize this:\n{content}\nFormat as JSON: {{'one_line_summary': '', 'bullet_points': [], 'five_sentence_summary': ''}}"
+        res = await gemini_service.generate_text(prompt, deadline=ctx.deadline)
+        try:
+            ctx.final_output.update(parse_json_output(res))
+            ctx.task_type = "summarization"
+        except:
+            log.status = "failed"
+            log.output_summary = "JSON parse error"
+
+class SentimentAnalysisHandler(StepHandler):
+    name = "sentiment_analysis"
+    outputs = frozenset({"sentiment"})
+    cost = 2
+
+    async def run(self, ctx, log):
+        content = ctx.extracted_text or ctx.text
+        prompt = f"Analyze sentiment:\n{content}\nFormat as JSON: {{'label': '', 'confidence': 0.0, 'justification': ''}}"
+        res = await gemini_service.generate_text(prompt, deadline=ctx.deadline)
+        try:
+            ctx.final_output.update(parse_json_output(res))
+            ctx.task_type = "sentiment"
+        except:
+            log.status = "failed"
+
+class CodeExplanationHandler(StepHandler):
+    name = "code_explanation"
+    outputs = frozenset({"code_explanation"})
+    cost = 3
+
+    async def run(self, ctx, log):
+        content = ctx.extracted_text or ctx.text
+        prompt = f"Explain code:\n{content}\nFormat as JSON: {{'what_it_does': '', 'bugs_or_issues': [], 'time_complexity': ''}}"
+        res = await gemini_service.generate_text(prompt, deadline=ctx.deadline)
+        try:
+            ctx.final_output.update(parse_json_output(res))
+            ctx.task_type = "code_explanation"
+        except:
+            log.status = "failed"
+
+class ConversationalAnswerHandler(StepHandler):
+    name = "conversational_answer"
+    outputs = frozenset({"answer"})
+    cost = 3
+
+    simple_greetings = {
+        'hi': 'Hello! How can I help you today?',
+        'hii': 'Hi there! What can I do for you?',
+        'hello': 'Hello! I\'m here to help with any questions you have.',
+        'hey': 'Hey! What would you like to know?'
+    }
+
+    def describe(self, ctx):
+        return f"Analyzing query: {ctx.text[:50]}..."
+
+    async def run(self, ctx, log):
+        # Fast path for simple greetings
+        if ctx.text.lower().strip() in self.simple_greetings:
+            ctx.final_output["message"] = self.simple_greetings[ctx.text.lower().strip()]
+            ctx.task_type = "conversation"
+            log.output_summary = "Fast greeting response"
+            return
+
+        content = ctx.extracted_text or ""
+        # Answer on top of a summary produced earlier in the plan instead of repeating it
+        if ctx.final_output.get("one_line_summary"):
+            content += f"\n\nSummary already given to the user: {ctx.final_output['one_line_summary']}"
+
+        # Build context with history including extracted content
+        history_context = ""
+        if ctx.conversation_history:
+            history_context = "\n\nPrevious Conversation:\n"
+            for msg in ctx.conversation_history[-6:]:  # Last 3 exchanges (6 messages)
+                role = msg.get('role', '').upper()
+                msg_content = msg.get('content', '')
+                extracted = msg.get('extracted_content', '')
+                history_context += f"{role}: {msg_content}\n"
+                if extracted:
+                    history_context += f"EXTRACTED CONTENT: {extracted[:500]}...\n"
+
+        prompt = f"""You are a helpful AI assistant. Use the context below to answer the user's question.
+
+Context from uploaded content:
+{content}
+{history_context}
+
+Current User Question: {ctx.text}
+
+Answer the question naturally and conversationally. If the question refers to previous context (like "he", "it", "this"), use the conversation history to understand what they're referring to."""
+
+        ans = await gemini_service.generate_text(prompt, deadline=ctx.deadline)
+        ctx.final_output["message"] = ans
+        ctx.task_type = "conversation"
+
+class StepRegistry:
+    def __init__(self):
+        self._handlers: Dict[str, StepHandler] = {}
+
+    def register(self, handler: StepHandler):
+        self._handlers[handler.name] = handler
+
+    def get(self, name: str) -> Optional[StepHandler]:
+        return self._handlers.get(name)
+
+    def names(self) -> List[str]:
+        return list(self._handlers)
+
+step_registry = StepRegistry()
+for _handler in (
+    ExtractPdfTextHandler(),
+    ExtractImageTextHandler(),
+    FetchYoutubeTranscriptHandler(),
+    TranscribeAudioHandler(),
+    SummarizeHandler(),
+    SentimentAnalysisHandler(),
+    CodeExplanationHandler(),
+    ConversationalAnswerHandler(),
+):
+    step_registry.register(_handler)
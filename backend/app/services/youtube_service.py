@@ -1,6 +1,9 @@
 
 from youtube_transcript_api import YouTubeTranscriptApi
 from app.core.logging import logger
+from app.core.deadline import Deadline, ensure_deadline
+from typing import Optional
+import asyncio
 import re
 
 class YouTubeService:
@@ -27,4 +30,9 @@ class YouTubeService:
             logger.error(f"YouTube transcript failed: {e}")
             return "Transcript unavailable for this video.", False
 
+    async def get_transcript_async(self, url: str, deadline: Optional[Deadline] = None) -> tuple[str, bool]:
+        """Fetches the transcript in a worker thread, bounded by the request deadline"""
+        deadline = ensure_deadline(deadline)
+        return await deadline.wait_for(asyncio.to_thread(self.get_transcript, url))
+
 youtube_service = YouTubeService()
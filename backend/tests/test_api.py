@@ -29,3 +29,517 @@ def test_agent_run_text_only():
         assert "Gemini" in data["error"] or "Key" in data["error"] or "quota" in str(data["error"]).lower()
     else:
         assert data["status"] in ["success", "needs_clarification"]
+
+def test_deadline_clamped_to_server_limits():
+    from app.core.config import settings
+    from app.core.deadline import Deadline
+    assert Deadline.from_request(10_000).budget_s == settings.REQUEST_TIMEOUT_MAX_S
+    assert Deadline.from_request(0.001).budget_s == settings.REQUEST_TIMEOUT_MIN_S
+    assert Deadline.from_request(None).budget_s == settings.REQUEST_TIMEOUT_DEFAULT_S
+
+def test_expired_deadline_returns_partial_with_unfinished_steps():
+    import asyncio
+    from app.core.deadline import Deadline
+    from app.models.schemas import PlanStep
+    from app.services.agent_executor import agent_executor
+    plan = [
+        PlanStep(name="conversational_answer", description="Greeting"),
+        PlanStep(name="summarize", description="Summarize"),
+    ]
+    response = asyncio.run(agent_executor.execute_plan(plan=plan, text="hi", deadline=Deadline(0)))
+    assert response.status == "partial"
+    assert [step.status for step in response.plan] == ["cancelled", "cancelled"]
+
+def test_agent_run_accepts_client_timeout():
+    response = client.post("/api/v1/agent/run", data={"text": "hi", "timeout_s": "20"})
+    assert response.status_code == 200
+    assert response.json()["status"] == "success"
+
+def _make_wav(seconds: int, rate: int = 8000) -> bytes:
+    import io, wave
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b"\x00\x00" * rate * seconds)
+    return buf.getvalue()
+
+def test_split_wav_into_overlapping_segments():
+    from app.services.audio_service import audio_service
+    audio = _make_wav(25)
+    duration, windows = audio_service.split_wav(audio, segment_s=10, overlap_s=2)
+    assert duration == 25
+    assert windows == [(0, 10), (8, 18), (16, 25)]
+    segment = audio_service.read_wav_segment(audio, *windows[2])
+    assert audio_service.is_wav(segment)
+    assert audio_service.split_wav(segment, segment_s=60)[0] == 9
+
+def test_stitch_segments_drops_overlap_and_adds_timestamps():
+    from app.models.schemas import TranscriptSegment
+    from app.services.audio_service import audio_service
+    segments = [
+        TranscriptSegment(index=1, start_s=55, end_s=115, text="we should ship it on Friday. Then we rest"),
+        TranscriptSegment(index=0, start_s=0, end_s=60, text="Welcome everyone. I think we should ship it"),
+    ]
+    assert audio_service.stitch_segments(segments) == (
+        "[00:00] Welcome everyone. I think we should ship it\n"
+        "[00:55] on Friday. Then we rest"
+    )
+
+def test_stitch_segments_keeps_phrases_recurring_outside_overlap():
+    from app.models.schemas import TranscriptSegment
+    from app.services.audio_service import audio_service
+    filler = " ".join(f"w{i}" for i in range(15))
+    segments = [
+        TranscriptSegment(index=0, start_s=0, end_s=60, text="So the budget is final, thanks for joining today"),
+        TranscriptSegment(index=1, start_s=55, end_s=115, text=f"joining today. Next topic: {filler} the budget is final for Q3"),
+    ]
+    assert audio_service.stitch_segments(segments).splitlines()[1] == (
+        f"[00:55] Next topic: {filler} the budget is final for Q3"
+    )
+
+def test_mp3_is_decoded_segmented_and_progress_published(monkeypatch, tmp_path):
+    import asyncio, subprocess
+    import pytest
+    from app.core.config import settings
+    from app.models.schemas import PlanStep
+    from app.services.agent_executor import agent_executor
+    from app.services.audio_service import audio_service
+    from app.services.content_service import content_service
+    from app.services.llm_gemini import gemini_service
+    from app.services.step_handlers import InputFile
+
+    ffmpeg = audio_service.ffmpeg_exe()
+    if not ffmpeg:
+        pytest.skip("no ffmpeg available")
+    mp3 = tmp_path / "meeting.mp3"
+    subprocess.run([ffmpeg, "-v", "error", "-f", "lavfi", "-i", "sine=duration=25", "-c:a", "libmp3lame", str(mp3)], check=True)
+
+    texts = iter(["Welcome to the meeting", "First item is hiring", "Second item is budget"])
+    progress = []
+
+    async def fake_audio_bytes(audio_bytes, mime_type, prompt, deadline=None):
+        assert mime_type == "audio/wav" and audio_service.is_wav(audio_bytes)
+        progress.append(content_service.get_text("progress-meeting-0123456789"))
+        return next(texts)
+
+    async def fake_generate_text(prompt, deadline=None, timeout=None):
+        progress.append(content_service.get_text("progress-meeting-0123456789"))
+        return '{"one_line_summary": "Hiring and budget", "bullet_points": [], "five_sentence_summary": ""}'
+
+    monkeypatch.setattr(settings, "AUDIO_SEGMENT_S", 10.0)
+    monkeypatch.setattr(settings, "AUDIO_SEGMENT_OVERLAP_S", 2.0)
+    monkeypatch.setattr(settings, "AUDIO_TRANSCRIBE_CONCURRENCY", 1)
+    monkeypatch.setattr(gemini_service, "generate_from_audio_bytes", fake_audio_bytes)
+    monkeypatch.setattr(gemini_service, "generate_text", fake_generate_text)
+    response = asyncio.run(agent_executor.execute_plan(
+        plan=[PlanStep(name="transcribe_audio", description="Transcribe")],
+        text="transcribe",
+        files=[InputFile("meeting.mp3", "audio/mpeg", mp3.read_bytes())],
+        progress_id="progress-meeting-0123456789"
+    ))
+    assert response.status == "success"
+    assert response.final_output["segment_count"] == 3
+    assert response.final_output["one_line_summary"] == "Hiring and budget"
+    # Progress grows segment by segment while the recording is still being transcribed
+    assert progress == [
+        None,
+        "[00:00] Welcome to the meeting",
+        "[00:00] Welcome to the meeting\n[00:08] First item is hiring",
+        "[00:00] Welcome to the meeting\n"
+        "[00:08] First item is hiring\n"
+        "[00:16] Second item is budget"
+    ]
+
+def test_audio_inline_limit_counts_base64_size(monkeypatch):
+    import asyncio
+    from app.core.config import settings
+    from app.services.audio_service import audio_service
+    from app.services.llm_gemini import gemini_service
+
+    async def inline(audio_bytes, mime_type, prompt, deadline=None):
+        return "inline"
+
+    async def uploaded(path, prompt, deadline=None):
+        return "uploaded"
+
+    monkeypatch.setattr(settings, "AUDIO_INLINE_MAX_BYTES", 1200)
+    monkeypatch.setattr(gemini_service, "generate_from_audio_bytes", inline)
+    monkeypatch.setattr(gemini_service, "generate_with_audio", uploaded)
+    # 900 raw bytes encode to 1200; 1000 raw bytes (1336 encoded) no longer fit inline
+    assert asyncio.run(audio_service._transcribe_clip(b"x" * 900, "p", None)) == "inline"
+    assert asyncio.run(audio_service._transcribe_clip(b"x" * 1000, "p", None)) == "uploaded"
+
+def test_audio_deadline_returns_partial_transcript(monkeypatch):
+    import asyncio
+    from app.core.config import settings
+    from app.core.deadline import Deadline
+    from app.models.schemas import PlanStep
+    from app.services.agent_executor import agent_executor
+    from app.services.content_service import content_service
+    from app.services.llm_gemini import gemini_service
+    from app.services.step_handlers import InputFile
+
+    calls = []
+
+    async def fake_audio_bytes(audio_bytes, mime_type, prompt, deadline=None):
+        calls.append(mime_type)
+        if len(calls) == 3:
+            # Last segment is still running when the budget runs out
+            await deadline.wait_for(asyncio.sleep(10))
+        return ["Welcome to the meeting", "First item is hiring"][len(calls) - 1]
+
+    monkeypatch.setattr(settings, "AUDIO_SEGMENT_S", 10.0)
+    monkeypatch.setattr(settings, "AUDIO_SEGMENT_OVERLAP_S", 2.0)
+    monkeypatch.setattr(gemini_service, "generate_from_audio_bytes", fake_audio_bytes)
+    response = asyncio.run(agent_executor.execute_plan(
+        plan=[PlanStep(name="transcribe_audio", description="Transcribe")],
+        text="transcribe",
+        files=[InputFile("meeting.wav", "audio/wav", _make_wav(25))],
+        deadline=Deadline(0.5)
+    ))
+    assert response.status == "partial"
+    assert content_service.get_text(response.extracted_content.content_id) == (
+        "[00:00] Welcome to the meeting\n"
+        "[00:08] First item is hiring\n"
+        "[00:16] [segment unavailable]"
+    )
+    assert "2/3 segments" in response.logs[0].output_summary
+
+def test_admission_round_robins_clients_and_sheds_load():
+    import asyncio
+    from app.services.admission_service import AdmissionService, AdmissionRejected
+
+    async def scenario():
+        admission = AdmissionService()
+        admission.max_concurrent = 1
+        order = []
+        release = asyncio.Event()
+
+        async def run(client_id, conversation_id):
+            async with admission.admit(client_id, conversation_id):
+                order.append(client_id)
+                await release.wait()
+
+        first = asyncio.create_task(run("a", "a1"))
+        await asyncio.sleep(0)
+        queued = [asyncio.create_task(run(c, conv)) for c, conv in [("a", "a2"), ("a", "a3"), ("b", "b1")]]
+        await asyncio.sleep(0)
+        assert admission.stats()["lanes"]["text"]["queue_depth"] == 3
+
+        admission._avg_run_s = 100.0
+        try:
+            async with admission.admit("c", max_wait_s=1):
+                pass
+            assert False, "expected rejection"
+        except AdmissionRejected as e:
+            assert e.retry_after_s >= 100
+
+        release.set()
+        await asyncio.gather(first, *queued)
+        return order
+
+    assert asyncio.run(scenario()) == ["a", "b", "a", "a"]
+
+def test_admission_ignores_client_id_header_unless_trusted(monkeypatch):
+    from starlette.requests import Request
+    from app.api.v1.endpoints.agent import _client_id
+    from app.core.config import settings
+    request = Request({"type": "http", "headers": [(b"x-client-id", b"rotating-1")], "client": ("10.0.0.7", 5000)})
+    assert _client_id(request) == "10.0.0.7"
+    monkeypatch.setattr(settings, "ADMISSION_TRUST_CLIENT_ID_HEADER", True)
+    assert _client_id(request) == "rotating-1"
+
+def test_admission_stats_endpoint():
+    response = client.get("/api/v1/agent/admission")
+    assert response.status_code == 200
+    assert set(response.json()["lanes"]) == {"text", "file"}
+
+def test_extracted_content_served_by_reference_with_ranges():
+    from app.services.content_service import content_service
+    ref = content_service.put("0123456789" * 100)
+    assert ref.length == 1000 and len(ref.preview) <= 500
+
+    response = client.get(f"/api/v1/agent/content/{ref.content_id}", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 10-19/1000"
+    assert response.text == "0123456789"
+
+    assert client.get(f"/api/v1/agent/content/{ref.content_id}", headers={"Range": "bytes=5000-"}).status_code == 416
+    assert client.get("/api/v1/agent/content/missing").status_code == 404
+
+def test_agent_run_field_selection():
+    response = client.post("/api/v1/agent/run", data={"text": "hi", "fields": "final_output"})
+    assert response.status_code == 200
+    assert set(response.json()) == {"status", "final_output"}
+
+def test_plan_optimizer_drops_wasted_steps():
+    from app.models.schemas import PlanStep
+    from app.services.plan_optimizer import plan_optimizer
+    from app.services.step_handlers import ExecutionContext
+    ctx = ExecutionContext(
+        text="summarize it",
+        conversation_history=[{"role": "agent", "content": "done", "extracted_content": "Earlier PDF text"}]
+    )
+    plan = [
+        PlanStep(name="extract_text_from_pdf", description="Extract PDF"),
+        PlanStep(name="summarize", description="Summarize"),
+        PlanStep(name="summarize", description="Summarize again"),
+        PlanStep(name="conversational_answer", description="Answer"),
+        PlanStep(name="made_up_step", description="Unknown"),
+    ]
+    plan, decisions = plan_optimizer.optimize(plan, ctx)
+    assert [step.status for step in plan] == ["skipped", "pending", "skipped", "pending", "skipped"]
+    assert len(decisions) == 3
+    assert "Earlier PDF text" in ctx.extracted_text
+
+def test_plan_optimizer_ignores_history_when_new_files_uploaded():
+    from app.models.schemas import PlanStep
+    from app.services.plan_optimizer import plan_optimizer
+    from app.services.step_handlers import ExecutionContext
+    ctx = ExecutionContext(
+        text="what about this one",
+        file_bytes=b"%PDF-new", file_name="new.pdf", file_type="application/pdf",
+        conversation_history=[{"role": "agent", "content": "done", "extracted_content": "Old document text"}]
+    )
+    plan = [
+        PlanStep(name="extract_text_from_image", description="Extract image"),
+        PlanStep(name="extract_text_from_pdf", description="Extract PDF"),
+        PlanStep(name="conversational_answer", description="Answer"),
+    ]
+    plan, decisions = plan_optimizer.optimize(plan, ctx)
+    assert [step.status for step in plan] == ["skipped", "pending", "pending"]
+    assert decisions == ["skipped extract_text_from_image: missing input file:image"]
+    assert ctx.extracted_text == ""
+
+def test_plan_optimizer_keeps_answer_when_user_asks_more_than_a_summary():
+    from app.models.schemas import PlanStep
+    from app.services.plan_optimizer import plan_optimizer
+    from app.services.step_handlers import ExecutionContext
+    ctx = ExecutionContext(
+        text="summarize this resume and tell me if it fits a backend role",
+        file_bytes=b"%PDF-fake", file_name="cv.pdf", file_type="application/pdf"
+    )
+    plan = [
+        PlanStep(name="extract_text_from_pdf", description="Extract PDF"),
+        PlanStep(name="summarize", description="Summarize"),
+        PlanStep(name="conversational_answer", description="Answer"),
+    ]
+    plan, _ = plan_optimizer.optimize(plan, ctx)
+    assert [step.status for step in plan] == ["pending", "pending", "pending"]
+
+def test_audio_question_still_answered(monkeypatch):
+    import asyncio, json
+    from app.models.schemas import PlanStep
+    from app.services.agent_executor import agent_executor
+    from app.services.audio_service import audio_service
+    from app.services.llm_gemini import gemini_service
+    from app.services.step_handlers import InputFile
+
+    async def fake_process_audio(audio_bytes, filename, deadline=None, on_partial=None):
+        return json.dumps({"transcript": "The budget is final for Q3.", "one_line_summary": "Budget talk"})
+
+    async def fake_generate_text(prompt, deadline=None, timeout=None):
+        assert "The budget is final for Q3." in prompt and "What did the speaker say about the budget?" in prompt
+        return "They said the budget is final for Q3."
+
+    monkeypatch.setattr(audio_service, "process_audio", fake_process_audio)
+    monkeypatch.setattr(gemini_service, "generate_text", fake_generate_text)
+    plan = [
+        PlanStep(name="transcribe_audio", description="Transcribe"),
+        PlanStep(name="conversational_answer", description="Answer"),
+    ]
+    response = asyncio.run(agent_executor.execute_plan(
+        plan=plan,
+        text="What did the speaker say about the budget?",
+        files=[InputFile("meeting.mp3", "audio/mpeg", b"not-really-audio")]
+    ))
+    assert [step.status for step in response.plan] == ["completed", "completed"]
+    assert response.final_output["message"] == "They said the budget is final for Q3."
+
+def test_summarize_still_runs_for_pdf_next_to_audio(monkeypatch):
+    import asyncio, json
+    from app.models.schemas import PlanStep
+    from app.services.agent_executor import agent_executor
+    from app.services.audio_service import audio_service
+    from app.services.llm_gemini import gemini_service
+    from app.services.pdf_service import pdf_service
+    from app.services.step_handlers import InputFile
+
+    async def fake_pdf(pdf_bytes, deadline=None):
+        return "Quarterly report text", 1.0
+
+    async def fake_process_audio(audio_bytes, filename, deadline=None, on_partial=None):
+        return json.dumps({"transcript": "Call recording text", "one_line_summary": "Call only"})
+
+    prompts = []
+
+    async def fake_generate_text(prompt, deadline=None, timeout=None):
+        prompts.append(prompt)
+        return '{"one_line_summary": "Report and call", "bullet_points": [], "five_sentence_summary": ""}'
+
+    monkeypatch.setattr(pdf_service, "extract_text_async", fake_pdf)
+    monkeypatch.setattr(audio_service, "process_audio", fake_process_audio)
+    monkeypatch.setattr(gemini_service, "generate_text", fake_generate_text)
+    plan = [
+        PlanStep(name="extract_text_from_pdf", description="Extract PDF"),
+        PlanStep(name="transcribe_audio", description="Transcribe"),
+        PlanStep(name="summarize", description="Summarize"),
+    ]
+    response = asyncio.run(agent_executor.execute_plan(plan=plan, text="summarize this", files=[
+        InputFile("report.pdf", "application/pdf", b"%PDF-quarterly-report"),
+        InputFile("call.mp3", "audio/mpeg", b"not-really-audio"),
+    ]))
+    assert [step.status for step in response.plan] == ["completed", "completed", "completed"]
+    assert "Quarterly report text" in prompts[0] and "Call recording text" in prompts[0]
+    assert response.final_output["one_line_summary"] == "Report and call"
+
+def test_fenced_audio_reply_is_parsed(monkeypatch):
+    import asyncio
+    from app.models.schemas import PlanStep
+    from app.services.agent_executor import agent_executor
+    from app.services.audio_service import audio_service
+    from app.services.step_handlers import InputFile
+
+    async def fake_process_audio(audio_bytes, filename, deadline=None, on_partial=None):
+        return '```json\n{"transcript": "Hello team", "one_line_summary": "Greeting"}\n```'
+
+    monkeypatch.setattr(audio_service, "process_audio", fake_process_audio)
+    plan = [
+        PlanStep(name="transcribe_audio", description="Transcribe"),
+        PlanStep(name="summarize", description="Summarize"),
+    ]
+    response = asyncio.run(agent_executor.execute_plan(
+        plan=plan, text="summarize this", files=[InputFile("memo.mp3", "audio/mpeg", b"not-really-audio")]
+    ))
+    assert [step.status for step in response.plan] == ["completed", "completed"]
+    assert response.final_output["one_line_summary"] == "Greeting"
+    assert response.logs[-1].output_summary == "Reused summary from audio processing"
+
+def test_several_audio_files_get_one_combined_summary(monkeypatch):
+    import asyncio, json
+    from app.models.schemas import PlanStep
+    from app.services.agent_executor import agent_executor
+    from app.services.audio_service import audio_service
+    from app.services.llm_gemini import gemini_service
+    from app.services.step_handlers import InputFile
+
+    async def fake_process_audio(audio_bytes, filename, deadline=None, on_partial=None):
+        return json.dumps({"transcript": f"Talk from {filename}", "one_line_summary": f"Only {filename}"})
+
+    prompts = []
+
+    async def fake_generate_text(prompt, deadline=None, timeout=None):
+        prompts.append(prompt)
+        return '{"one_line_summary": "Both talks", "bullet_points": [], "five_sentence_summary": ""}'
+
+    monkeypatch.setattr(audio_service, "process_audio", fake_process_audio)
+    monkeypatch.setattr(gemini_service, "generate_text", fake_generate_text)
+    response = asyncio.run(agent_executor.execute_plan(
+        plan=[PlanStep(name="transcribe_audio", description="Transcribe")],
+        text="what were these about",
+        files=[InputFile("a.mp3", "audio/mpeg", b"first"), InputFile("b.mp3", "audio/mpeg", b"second")]
+    ))
+    assert [step.name for step in response.plan] == ["transcribe_audio", "summarize"]
+    assert "=== a.mp3 ===\nTalk from a.mp3" in prompts[0] and "=== b.mp3 ===\nTalk from b.mp3" in prompts[0]
+    assert response.final_output["one_line_summary"] == "Both talks"
+    assert len(response.final_output["audio_files"]) == 2
+
+def test_plan_optimizer_reuses_cached_extraction():
+    from app.models.schemas import PlanStep
+    from app.services.content_service import content_service
+    from app.services.plan_optimizer import plan_optimizer
+    from app.services.step_handlers import ExecutionContext, step_registry
+    ctx = ExecutionContext(text="analyze", file_bytes=b"%PDF-fake", file_name="cv.pdf", file_type="application/pdf")
+    content_service.remember_source(step_registry.get("extract_text_from_pdf").source_key(ctx.files[0]), "Cached resume")
+    plan, _ = plan_optimizer.optimize([PlanStep(name="extract_text_from_pdf", description="Extract PDF")], ctx)
+    assert plan[0].status == "skipped"
+    assert ctx.last_extracted == "Cached resume"
+
+def test_agent_run_multiple_files_extracted_together():
+    files = [
+        ("files", ("a.pdf", b"%PDF-not-really", "application/pdf")),
+        ("files", ("b.pdf", b"%PDF-also-not", "application/pdf")),
+        ("files", ("c.png", b"not-an-image", "image/png")),
+    ]
+    response = client.post("/api/v1/agent/run", data={"text": "compare these"}, files=files)
+    assert response.status_code == 200
+    data = response.json()
+    assert [step["name"] for step in data["plan"]] == ["extract_text_from_pdf", "extract_text_from_image", "conversational_answer"]
+    assert "a.pdf, b.pdf" in data["logs"][0]["input_summary"]
+
+def test_extracted_sections_labelled_per_file():
+    from app.services.step_handlers import ExecutionContext, InputFile
+    ctx = ExecutionContext(text="", files=[InputFile("a.pdf", "application/pdf", b"1"), InputFile("b.png", "image/png", b"2")])
+    ctx.add_extracted("first", label="a.pdf")
+    ctx.add_extracted("second", label="b.png")
+    assert ctx.extracted_for_response() == "=== a.pdf ===\nfirst\n\n=== b.png ===\nsecond"
+
+def test_gemini_transport_reuses_connections_against_local_stand_in():
+    import asyncio, json, threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from app.services.gemini_transport import GeminiTransport, GeminiTransportError, InlineBlob
+
+    seen = []
+
+    class StandIn(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # keep-alive
+
+        def _reply(self, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if "missing" in self.path:
+                body = b'{"error": {"message": "not found"}}'
+                self.send_response(404)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            self._reply({"name": self.path})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            seen.append((self.path, self.headers["x-goog-api-key"], body))
+            self._reply({"candidates": [{"content": {"parts": [{"text": "pong"}]}}]})
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        transport = GeminiTransport("test-key", base_url=f"http://127.0.0.1:{server.server_port}", pool_size=2)
+
+        async def scenario():
+            await transport.warm_up("gemini-test")
+            first = await transport.generate("gemini-test", ["ping"])
+            second = await transport.generate("gemini-test", ["ping", InlineBlob("image/png", b"\x89PNG")])
+            try:
+                await transport.warm_up("missing")
+                await transport._request("GET", "/v1beta/models/missing")
+                assert False, "expected an API error"
+            except GeminiTransportError as e:
+                assert e.status_code == 404
+            assert await transport.run_blocking(sum, [1, 2]) == 3
+            await transport.aclose()
+            return first, second
+
+        assert asyncio.run(scenario()) == ("pong", "pong")
+    finally:
+        server.shutdown()
+
+    stats = transport.stats()
+    assert transport._executor is None # thread pool shut down with the client
+    assert stats["requests"] == 5 and stats["errors"] == 2
+    # Failed requests don't count as reuse even though they went over the pooled connection
+    assert stats["new_connections"] == 1 and stats["reused_connections"] == 2
+    path, api_key, body = seen[1]
+    assert path == "/v1beta/models/gemini-test:generateContent" and api_key == "test-key"
+    assert body["contents"][0]["parts"][1] == {"inline_data": {"mime_type": "image/png", "data": "iVBORw=="}}
@@ -11,6 +11,23 @@ interface Props {
 const MessageBubble: React.FC<Props> = ({ message }) => {
   const isUser = message.role === 'user';
   const [showExtracted, setShowExtracted] = useState(false);
+  const [extractedText, setExtractedText] = useState<string | null>(null);
+
+  const extracted = message.response?.extracted_content;
+
+  const toggleExtracted = async () => {
+    // Full text is served by reference; fetch it the first time the panel opens
+    if (!showExtracted && extracted && extractedText === null) {
+      try {
+        const res = await fetch(`http://localhost:8000/api/v1/agent/content/${extracted.content_id}`);
+        setExtractedText(res.ok ? await res.text() : extracted.preview);
+      } catch (err) {
+        console.error(err);
+        setExtractedText(extracted.preview);
+      }
+    }
+    setShowExtracted(!showExtracted);
+  };
 
   if (message.isThinking) {
     return (
@@ -131,10 +148,10 @@ const MessageBubble: React.FC<Props> = ({ message }) => {
         {renderContent()}
 
         {/* Extracted Text (Agent Only) */}
-        {!isUser && message.response?.extracted_text && (
+        {!isUser && extracted && (
           <div style={{marginTop: '15px', borderTop: '1px solid var(--glass-border)', paddingTop: '10px'}}>
             <button 
-              onClick={() => setShowExtracted(!showExtracted)}
+              onClick={toggleExtracted}
               style={{background: 'none', border: 'none', color: 'var(--text-color)', display: 'flex', alignItems: 'center', gap: '5px', cursor: 'pointer', fontSize: '0.85em', opacity: 0.8}}
             >
               {showExtracted ? <ChevronDown size={14}/> : <ChevronRight size={14}/>}
@@ -142,7 +159,7 @@ const MessageBubble: React.FC<Props> = ({ message }) => {
             </button>
             {showExtracted && (
               <div style={{background: 'rgba(0,0,0,0.2)', padding: '10px', borderRadius: '4px', marginTop: '5px', maxHeight: '200px', overflowY: 'auto', fontSize: '0.85em', whiteSpace: 'pre-wrap'}}>
-                {message.response.extracted_text}
+                {extractedText ?? extracted.preview}
               </div>
             )}
           </div>
@@ -2,7 +2,7 @@
 export interface PlanStep {
   name: string;
   description: string;
-  status: "pending" | "running" | "completed" | "failed";
+  status: "pending" | "running" | "completed" | "failed" | "cancelled" | "skipped";
 }
 
 export interface LogEntry {
@@ -13,10 +13,17 @@ export interface LogEntry {
   duration_ms: number;
 }
 
+export interface ExtractedContentRef {
+  content_id: string;
+  length: number;
+  byte_length: number;
+  preview: string;
+}
+
 export interface AgentResponse {
-  status: "success" | "error" | "needs_clarification";
+  status: "success" | "error" | "needs_clarification" | "partial";
   clarification_question?: string;
-  extracted_text?: string;
+  extracted_content?: ExtractedContentRef;
   final_output?: any;
   task_type?: string;
   plan: PlanStep[];